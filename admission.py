@@ -0,0 +1,91 @@
+import threading
+from cache import TTLCache
+from ratelimit import TokenBucket
+
+
+class Rejected(Exception):
+    """Запрос отклонён контролем допуска; reason — код причины для статистики"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Контроль допуска загрузок до постановки в очередь.
+
+    Для каждого тарифа (default, premium, admin) задаются лимит одновременных
+    загрузок пользователя (concurrent) и token bucket запросов: per_minute в
+    минуту, не больше burst подряд. Общий потолок max_concurrent ограничивает
+    число принятых загрузок на весь бот; администраторы его не учитывают.
+    Каждый успешный admit() должен завершаться release() с тем же числом слотов.
+    """
+
+    def __init__(self, tiers, max_concurrent=50, admin_ids=()):
+        self.tiers = tiers
+        self.max_concurrent = max_concurrent
+        self.admin_ids = set(admin_ids)
+        self._active = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        # Бакеты неактивных пользователей вытесняются; сброс бакета лишь возвращает запас burst
+        self._buckets = TTLCache(maxsize=100000, ttl=3600)
+
+    def tier_for(self, user):
+        """Тариф пользователя Telegram"""
+        if user.id in self.admin_ids:
+            return 'admin'
+        if getattr(user, 'is_premium', False):
+            return 'premium'
+        return 'default'
+
+    def limits_for(self, user):
+        """Лимиты тарифа пользователя"""
+        return self.tiers.get(self.tier_for(user)) or self.tiers['default']
+
+    def admit(self, user, links=1, slots=1):
+        """Принимает запрос пользователя или бросает Rejected.
+
+        Каждая ссылка запроса расходует токен; запрос занимает до slots свободных
+        слотов одновременных загрузок. Возвращает число занятых слотов.
+        """
+        tier = self.tier_for(user)
+        limits = self.limits_for(user)
+
+        with self._lock:
+            active = self._active.get(user.id, 0)
+            if active >= limits['concurrent']:
+                raise Rejected('user_concurrency',
+                               f"У вас вже {active} завантажень у роботі. Дочекайтеся їх завершення.")
+            if tier != 'admin' and self._total >= self.max_concurrent:
+                raise Rejected('global_concurrency', "Бот зараз перевантажений. Спробуйте за кілька хвилин.")
+
+            bucket = self._buckets.get(user.id)
+            if bucket is None or bucket.rate != limits['per_minute'] / 60:
+                bucket = TokenBucket(limits['per_minute'] / 60, capacity=limits['burst'])
+                self._buckets.set(user.id, bucket)
+            if not bucket.try_acquire(links):
+                raise Rejected('rate_limit', "Забагато запитів. Спробуйте трохи пізніше.")
+
+            granted = min(slots, limits['concurrent'] - active)
+            if tier != 'admin':
+                granted = min(granted, self.max_concurrent - self._total)
+            self._active[user.id] = active + granted
+            self._total += granted
+        return granted
+
+    def release(self, user_id, slots=1):
+        with self._lock:
+            active = self._active.get(user_id, 0)
+            slots = min(slots, active)
+            if slots <= 0:
+                return
+            if active == slots:
+                del self._active[user_id]
+            else:
+                self._active[user_id] = active - slots
+            self._total -= slots
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._total, 'users': len(self._active), 'max_concurrent': self.max_concurrent}
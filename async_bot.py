@@ -0,0 +1,251 @@
+"""Асинхронная точка входа бота на AsyncTeleBot.
+
+Запуск: python async_bot.py. Обработчики — корутины, запросы к Bot API идут через
+общий пул соединений aiohttp, а yt-dlp и тяжёлые действия админа выполняются в пулах
+потоков. Запись в SQLite идёт через буфер отложенной записи и цикл событий не блокирует.
+Загрузки и рассылки используют те же очереди, что и синхронный bot.py.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+import config
+import keyboards
+import logsetup
+import metrics
+import urls
+from cache import TTLCache
+from database import db_manager
+import bot as sync_bot
+from bot import safe_text, extract_user_data, build_subscription_message, REQUIRED_CHANNELS
+
+# Размер пула соединений aiohttp задаётся до создания сессии
+asyncio_helper.REQUEST_LIMIT = config.async_connection_limit
+if config.bot_api_url:
+    asyncio_helper.API_URL = config.bot_api_url.rstrip('/') + '/bot{0}/{1}'
+    asyncio_helper.FILE_URL = config.bot_api_url.rstrip('/') + '/file/bot{0}/{1}'
+
+def count_rate_limits(check_result):
+    """Асинхронный вариант bot.count_rate_limits"""
+    async def wrapper(method_name, result):
+        try:
+            return await check_result(method_name, result)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                metrics.rate_limited.labels(method_name).inc()
+            raise
+    return wrapper
+
+asyncio_helper._check_result = count_rate_limits(asyncio_helper._check_result)
+
+abot = AsyncTeleBot(config.token)
+
+# Пул для тяжёлых синхронных действий админа (экспорт, статистика)
+admin_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='admin')
+
+subscription_cache = TTLCache(maxsize=config.subscription_cache_size, ttl=config.subscription_cache_ttl)
+
+async def check_channel(channel, user_id):
+    """Проверяет подписку на один канал; возвращает (подписан, можно_кэшировать)"""
+    try:
+        member = await abot.get_chat_member(channel['id'], user_id)
+        return member.status not in ["left", "kicked"], True
+
+    except ApiTelegramException as e:
+        logging.warning(f"API Error while checking {channel['id']} for user {user_id}: {e}")
+        # «not found» — пользователь не подписан, остальные ошибки не кэшируем
+        return False, "not found" in str(e).lower()
+
+    except Exception as e:
+        logging.error(f"Unexpected error while checking {channel['id']} for user {user_id}: {e}")
+        return False, False
+
+async def check_subscriptions(user_id):
+    """Проверяет подписки пользователя на все необходимые каналы"""
+    started = time.monotonic()
+    results = {}
+    pending = []
+
+    for channel in REQUIRED_CHANNELS:
+        subscribed = subscription_cache.get((user_id, channel['id']))
+        if subscribed is None:
+            pending.append(channel)
+        else:
+            results[channel['id']] = subscribed
+
+    if pending:
+        async def checked(channel):
+            try:
+                return await asyncio.wait_for(check_channel(channel, user_id), config.subscription_check_timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Timeout while checking {channel['id']} for user {user_id}")
+                return False, False
+
+        for channel, (subscribed, cacheable) in zip(pending, await asyncio.gather(*map(checked, pending))):
+            results[channel['id']] = subscribed
+            if cacheable:
+                ttl = config.subscription_cache_ttl if subscribed else config.subscription_cache_negative_ttl
+                subscription_cache.set((user_id, channel['id']), subscribed, ttl=ttl)
+
+    metrics.observe('subscription_check', time.monotonic() - started)
+    return [channel for channel in REQUIRED_CHANNELS if not results[channel['id']]]
+
+async def send_subscription_message(user_id, unsubscribed_channels):
+    text, markup = build_subscription_message(unsubscribed_channels)
+
+    try:
+        await abot.send_message(user_id, safe_text(text), parse_mode="markdown",
+                                reply_markup=markup, disable_web_page_preview=True)
+    except Exception as e:
+        logging.error(f"Error sending subscription message: {e}")
+        await abot.send_message(user_id, "Для использования бота необходимо подписаться на все каналы.",
+                                reply_markup=markup)
+
+@abot.message_handler(commands=['start'])
+async def start_command(message):
+    user_id = message.from_user.id
+    logsetup.request_id.set(f"{user_id}:{message.message_id}")
+    logging.info(f"Start command from user {user_id} (@{message.from_user.username or 'Unknown'})")
+
+    # save_user лишь кладёт запись в буфер отложенной записи — executor не нужен
+    db_manager.save_user(extract_user_data(message.from_user))
+
+    unsubscribed = await check_subscriptions(user_id)
+    if unsubscribed:
+        await send_subscription_message(user_id, unsubscribed)
+    else:
+        await abot.send_message(user_id, safe_text('*Добро пожаловать! Отправьте ссылку на YouTube видео для скачивания.*'),
+                                parse_mode="markdown", reply_markup=keyboards.main_menu())
+
+@abot.message_handler(func=lambda message: True, content_types=sync_bot.MESSAGE_CONTENT_TYPES)
+async def handle_message(message):
+    user_id = message.from_user.id
+    logsetup.request_id.set(f"{user_id}:{message.message_id}")
+    db_manager.save_user(extract_user_data(message.from_user))
+
+    unsubscribed = await check_subscriptions(user_id)
+    if unsubscribed:
+        await send_subscription_message(user_id, unsubscribed)
+        return
+
+    if message.text == 'panda' and user_id in config.admin_ids:
+        await abot.send_message(user_id, safe_text('🥰 *Привет, админ!*'),
+                                parse_mode='markdown', reply_markup=keyboards.admin_menu())
+        return
+
+    # Состояния админа (настройки, запуск рассылки) обрабатываются синхронным кодом в пуле
+    if user_id in sync_bot.adm_state and message.text is not None:
+        await asyncio.get_running_loop().run_in_executor(
+            admin_executor, sync_bot.handle_admin_state, message, user_id)
+        return
+
+    video_ids = urls.message_video_ids(message)
+    if video_ids:
+        await download_youtube_video(message, user_id, video_ids)
+    elif message.text == '⚙️ Главное меню':
+        await abot.send_message(user_id, safe_text('*Главное меню*'),
+                                parse_mode='markdown', reply_markup=keyboards.main_menu())
+    else:
+        await abot.send_message(user_id, safe_text('*Отправьте ссылку на YouTube видео для скачивания.*'),
+                                parse_mode='markdown', reply_markup=keyboards.main_menu())
+
+async def download_youtube_video(message, user_id, video_ids):
+    """Ставит ссылки из сообщения в общую очередь пакетом; yt-dlp и отправка выполняются её воркерами"""
+    # Контроль допуска и постановка в очередь не блокируют — вызываем напрямую
+    batch, skipped = sync_bot.prepare_batch(message, user_id, video_ids)
+    rejection = sync_bot.admit_download(message, user_id, batch)
+    if rejection:
+        await abot.send_message(user_id, safe_text(f'❌ {rejection}'))
+        return
+
+    if skipped:
+        await abot.send_message(user_id, safe_text(f'⚠️ За раз обробляю не більше {len(batch.jobs)} посилань, '
+                                                   f'решту ({skipped}) пропущено.'))
+
+    try:
+        for job in batch.jobs:
+            msg = await abot.send_message(user_id, safe_text('⏳ _Идёт загрузка..._'), parse_mode='markdown')
+            job.status_message_id = msg.message_id
+    except Exception:
+        sync_bot.admission.release(user_id, batch.parallelism)
+        raise
+
+    submitted, rejected = sync_bot.submit_batch(batch)
+    for job in submitted:
+        if job.position:
+            await abot.edit_message_text(safe_text(f'⏳ _Ви в черзі: позиція {job.position}_'),
+                                         user_id, job.status_message_id, parse_mode='markdown')
+    for job in rejected:
+        await abot.edit_message_text(sync_bot.queue_full_text(), user_id, job.status_message_id)
+
+@abot.callback_query_handler(func=lambda call: True)
+async def callbacks(call):
+    user_id = call.from_user.id
+    logsetup.request_id.set(f"{user_id}:cb{call.id}")
+
+    try:
+        if call.data == 'check_subscription':
+            for channel in REQUIRED_CHANNELS:
+                subscription_cache.pop((user_id, channel['id']))
+
+            unsubscribed = await check_subscriptions(user_id)
+            if unsubscribed:
+                await abot.answer_callback_query(call.id, f"❌ Подпишитесь на все каналы!\nОсталось: {len(unsubscribed)}",
+                                                 show_alert=True)
+                await send_subscription_message(user_id, unsubscribed)
+                try:
+                    await abot.delete_message(user_id, call.message.message_id)
+                except Exception:
+                    pass
+            else:
+                await abot.answer_callback_query(call.id, "✅ Отлично! Добро пожаловать!")
+                await abot.edit_message_text(safe_text('*🎉 Добро пожаловать!*\n\nТеперь вы можете пользоваться ботом.\nОтправьте ссылку на YouTube видео для скачивания.'),
+                                             user_id, call.message.message_id,
+                                             parse_mode='markdown', reply_markup=keyboards.main_menu())
+
+        elif call.data == 'menu':
+            await abot.edit_message_text(safe_text('*Главное меню*'),
+                                         user_id, call.message.message_id,
+                                         parse_mode='markdown', reply_markup=keyboards.main_menu())
+
+        elif call.data == 'information':
+            await abot.edit_message_text(safe_text('ℹ️ *Информация о боте*'),
+                                         user_id, call.message.message_id,
+                                         parse_mode='markdown', reply_markup=keyboards.information())
+
+        # Админские callback'и редки и тяжелы (экспорт, статистика) — выполняем их синхронно в пуле
+        elif call.data in ['base_export_json', 'base_export_sql', 'base_settings', 'bot_statistics',
+                          'change_channel_id', 'change_channel_url', 'sendall']:
+            await asyncio.get_running_loop().run_in_executor(
+                admin_executor, sync_bot.handle_admin_callbacks, call)
+
+    except Exception as e:
+        logging.error(f"Callback error: {e}")
+        await abot.answer_callback_query(call.id, "Произошла ошибка")
+
+async def main():
+    # Пул по умолчанию для run_in_executor (yt-dlp, файловые операции)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=config.async_executor_workers, thread_name_prefix='executor'))
+
+    sync_bot.download_cache.recover()
+    sync_bot.download_queue.start()
+    sync_bot.broadcaster.resume_all()
+    metrics_server = sync_bot.start_metrics()
+
+    logging.info("Async bot starting...")
+    try:
+        await abot.delete_webhook()
+        await abot.infinity_polling(timeout=10)
+    finally:
+        await abot.close_session()
+        sync_bot.broadcaster.stop(timeout=10)
+        sync_bot.download_queue.stop(timeout=60)
+        sync_bot.stop_metrics(metrics_server)
+        db_manager.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,741 @@
+"""Офлайн-бенчмарки бота: фейковый Bot API, фейковый экстрактор и временная база.
+
+Сеть не нужна: запросы к Bot API принимает локальный сервер-заглушка (через
+bot_api_url), а вместо YouTube метаданные отдаёт фейковый экстрактор, чьи
+форматы указывают на синтетические файлы заданного размера и задержки.
+
+Запуск:
+    python bench.py                                  # все сценарии
+    python bench.py messages downloads --n 2000
+    python bench.py broadcast --n 10000 --set broadcast_rate=1000
+    python bench.py stats --rows 1000000
+    python bench.py messages --webhook               # обновления через WebhookServer
+    python bench.py downloads --video-rate 2000000 --fragments 20 --set concurrent_fragment_downloads=8
+
+Каждый сценарий выполняется в отдельном процессе во временном каталоге со своей
+settings.json и базой. Результат — JSON-строки (коммит, сценарий, параметры,
+ops/s, p50/p99 в мс, пиковый RSS), которые печатаются и дописываются в
+bench_output.txt для сравнения между коммитами.
+"""
+import argparse
+import copy
+import json
+import os
+import re
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCENARIOS = ('messages', 'callbacks', 'downloads', 'broadcast', 'stats')
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_TOKEN = '123456:bench'
+FIRST_USER_ID = 10_000_000
+
+MULTIPART_FIELD_RE = re.compile(rb'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n(.*?)\r\n--', re.S)
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — в КБ
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def result(scenario, count, seconds, latencies, **params):
+    """Строка отчёта: latencies — длительности отдельных операций в секундах"""
+    return {
+        'scenario': scenario,
+        'count': count,
+        'seconds': round(seconds, 3),
+        'ops_per_sec': round(count / seconds, 1) if seconds > 0 else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'params': params,
+    }
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _StubServer:
+    def __init__(self, handler):
+        self._server = _HTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeBotAPI(_StubServer):
+    """Заглушка Bot API: отвечает на методы, которыми пользуется бот, и сообщает о каждом запросе.
+
+    latency — задержка ответа (сек); rate_limit_every — каждый N-й sendMessage получает 429.
+    """
+
+    def __init__(self, latency=0.0, rate_limit_every=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.listeners = []
+        self.calls = {}
+        self._message_id = 0
+        self._lock = threading.Lock()
+        super().__init__(self._make_handler())
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            return self.calls[method]
+
+    def _message(self, params, **extra):
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': int(params.get('message_id') or self._next_message_id()),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', ''),
+            **extra,
+        }
+
+    def respond(self, method, params):
+        """Возвращает (HTTP-код, тело ответа)"""
+        number = self._count(method)
+        if method == 'sendMessage' and self.rate_limit_every and number % self.rate_limit_every == 0:
+            return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                         'parameters': {'retry_after': 1}}
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getChatMember':
+            result = {'user': {'id': int(params.get('user_id', 0)), 'is_bot': False, 'first_name': 'U'},
+                      'status': 'member'}
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        elif method == 'sendVideo':
+            file_id = f'video-{number}'
+            result = self._message(params, video={'file_id': file_id, 'file_unique_id': file_id,
+                                                  'width': 1920, 'height': 1080, 'duration': 1})
+        elif method == 'sendDocument':
+            file_id = f'document-{number}'
+            result = self._message(params, document={'file_id': file_id, 'file_unique_id': file_id})
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Иначе заголовки и тело уходят отдельными пакетами и ответ ждёт delayed ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._handle({**self._query(), **self._parse(body)})
+
+            def do_GET(self):
+                self._handle(self._query())
+
+            def _query(self):
+                # telebot передаёт параметры в строке запроса, файлы — в multipart-теле
+                return dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+
+            def _parse(self, body):
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('multipart/form-data'):
+                    # Файлы не разбираем — нужны только обычные поля
+                    return {name.decode(): value.decode('utf-8', 'replace')
+                            for name, value in MULTIPART_FIELD_RE.findall(body) if len(value) < 4096}
+                if content_type.startswith('application/json'):
+                    return json.loads(body or b'{}')
+                return dict(urllib.parse.parse_qsl(body.decode('utf-8', 'replace')))
+
+            def _handle(self, params):
+                method = urllib.parse.urlsplit(self.path).path.rsplit('/', 1)[-1]
+                if api.latency:
+                    time.sleep(api.latency)
+
+                code, response = api.respond(method, params)
+                for listener in api.listeners:
+                    listener(method, params)
+
+                data = json.dumps(response).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeMediaServer(_StubServer):
+    """Отдаёт синтетические файлы: /media/<имя>?size=<байт>&delay=<сек до первого байта>&rate=<байт/с>
+
+    rate ограничивает скорость одного соединения — так моделируется пропускная
+    способность одного TCP-потока, упирающаяся не в канал, а в сам поток.
+    """
+
+    CHUNK = b'\0' * 65536
+
+    def __init__(self):
+        super().__init__(self._make_handler())
+
+    def _make_handler(self):
+        chunk = self.CHUNK
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Иначе заголовки и тело уходят отдельными пакетами и ответ ждёт delayed ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+                size = int(query.get('size', 1024 * 1024))
+                rate = float(query.get('rate', 0))
+                time.sleep(float(query.get('delay', 0)))
+
+                start, end = 0, size - 1
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else end
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+
+                remaining = end - start + 1
+                sent = 0
+                started = time.monotonic()
+                while remaining > 0:
+                    piece = chunk[:min(len(chunk), remaining)]
+                    self.wfile.write(piece)
+                    remaining -= len(piece)
+                    sent += len(piece)
+                    if rate:
+                        time.sleep(max(0.0, sent / rate - (time.monotonic() - started)))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeExtractor:
+    """Замена downloader.extract_info: info-словарь с одним форматом на FakeMediaServer.
+
+    При fragments > 0 формат отдаётся как DASH из стольких фрагментов — его
+    качает фрагментный загрузчик yt-dlp (concurrent_fragment_downloads).
+    """
+
+    def __init__(self, media_url, size, delay=0.0, extract_delay=0.0, rate=0, fragments=0):
+        self.media_url = media_url
+        self.size = size
+        self.delay = delay
+        self.extract_delay = extract_delay
+        self.rate = rate
+        self.fragments = fragments
+
+    def media(self, name, size):
+        return f'{self.media_url}/media/{name}?size={size}&delay={self.delay}&rate={self.rate}'
+
+    def format(self):
+        fmt = {
+            'format_id': '18',
+            'ext': 'mp4',
+            'vcodec': 'avc1.42001E',
+            'acodec': 'mp4a.40.2',
+            'height': 360,
+            'filesize': self.size,
+        }
+        if not self.fragments:
+            return {**fmt, 'url': self.media('video.mp4', self.size), 'protocol': 'http'}
+
+        sizes = [self.size // self.fragments] * self.fragments
+        sizes[-1] += self.size - sum(sizes)
+        return {
+            **fmt,
+            'url': self.media('manifest.mpd', 0),
+            'protocol': 'http_dash_segments',
+            'fragments': [{'url': self.media(f'frag{i}.m4s', size), 'duration': 60 / self.fragments}
+                          for i, size in enumerate(sizes)],
+        }
+
+    def info(self, video_id):
+        return {
+            'id': video_id,
+            'title': f'Bench video {video_id}',
+            'duration': 60,
+            'extractor': 'generic',
+            'extractor_key': 'Generic',
+            'webpage_url': f'https://youtu.be/{video_id}',
+            'formats': [self.format()],
+        }
+
+    def install(self, downloader):
+        import urls
+        original = downloader.extract_info
+
+        def extract_info(url):
+            video_id = urls.extract_video_id(url)
+            info = downloader.info_cache.get(video_id)
+            if info is None:
+                if self.extract_delay:
+                    time.sleep(self.extract_delay)
+                info = self.info(video_id)
+                downloader.info_cache.set(video_id, info)
+            return copy.deepcopy(info)
+
+        downloader.extract_info = extract_info
+        return original
+
+
+class CompletionTracker:
+    """Ждёт «финального» запроса к Bot API по каждому чату и считает задержку от отправки обновления"""
+
+    def __init__(self, is_final):
+        self.is_final = is_final
+        self.started = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def start(self, chat_id):
+        with self._lock:
+            self.started[chat_id] = time.monotonic()
+
+    def __call__(self, method, params):
+        if not self.is_final(method, params):
+            return
+        chat_id = int(params.get('chat_id') or 0)
+        with self._lock:
+            if chat_id in self.started and chat_id not in self.latencies:
+                self.latencies[chat_id] = time.monotonic() - self.started[chat_id]
+                self._done.notify_all()
+
+    def wait(self, count, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self.latencies) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._done.wait(remaining)
+            return list(self.latencies.values())
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'text': text,
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message_update(update_id, user_id, 'menu')['message'],
+        },
+    }
+
+
+def prepare_workdir(args, api_url, overrides):
+    """Создаёт временный каталог с settings.json и делает его текущим"""
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    with open(os.path.join(ROOT, 'settings.json'), encoding='utf-8') as f:
+        settings = json.load(f)
+
+    settings.update({
+        'token': BENCH_TOKEN,
+        'bot_api_url': api_url,
+        'local_bot_api': False,
+        'webhook_enabled': args.webhook,
+        'webhook_host': '127.0.0.1',
+        'webhook_port': 0,
+        'webhook_url': '',
+        # Ограничения рассчитаны на реальный трафик; в бенчмарке они скрыли бы пропускную способность
+        'download_queue_size': max(args.n, 100),
+        'max_concurrent_downloads': max(args.n, 100),
+        'info_cache_ttl': 3600,
+        'broadcast_rate': 100000,
+        'progress_edit_rate': 1000,
+        **overrides,
+    })
+    with open(os.path.join(workdir, 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump(settings, f)
+
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    return workdir
+
+
+def deliver(bot_module, updates, webhook_server):
+    """Передаёт обновления боту так же, как polling (пачками) или webhook (HTTP POST)"""
+    import telebot
+
+    if webhook_server is None:
+        for i in range(0, len(updates), 100):
+            bot_module.bot.process_new_updates([telebot.types.Update.de_json(u) for u in updates[i:i + 100]])
+        return
+
+    host, port = webhook_server.address
+    url = f'http://{host}:{port}{webhook_server.path}'
+
+    def post(update):
+        request = urllib.request.Request(url, data=json.dumps(update).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request, timeout=30).read()
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(post, updates))
+
+
+def run_update_storm(args, scenario, api, make_update, is_final):
+    import bot as bot_module
+
+    webhook_server = None
+    if args.webhook:
+        from webhook import WebhookServer
+        webhook_server = WebhookServer(bot_module.bot, host='127.0.0.1', port=0, path='/bench',
+                                       queue_size=max(args.n, 1000), workers=8)
+        webhook_server.start()
+
+    tracker = CompletionTracker(is_final)
+    api.listeners.append(tracker)
+    # Как при запуске bot.py
+    bot_module.download_cache.recover()
+    bot_module.download_queue.start()
+
+    updates = []
+    for i in range(args.n):
+        user_id = FIRST_USER_ID + i
+        tracker.start(user_id)
+        updates.append(make_update(i + 1, user_id))
+
+    started = time.monotonic()
+    deliver(bot_module, updates, webhook_server)
+    latencies = tracker.wait(args.n, args.timeout)
+    seconds = time.monotonic() - started
+
+    if webhook_server:
+        webhook_server.stop(timeout=10)
+    bot_module.download_queue.stop(timeout=10)
+    bot_module.db_manager.close()
+
+    params = {'n': args.n, 'completed': len(latencies), 'webhook': args.webhook, 'api_latency': args.api_latency}
+    if scenario == 'downloads':
+        params.update(videos=args.videos, video_size=args.video_size, video_delay=args.video_delay,
+                      extract_delay=args.extract_delay, video_rate=args.video_rate, fragments=args.fragments)
+    return [result(scenario, len(latencies), seconds, latencies, **params)]
+
+
+def scenario_messages(args, api):
+    """Шторм текстовых сообщений: проверка подписки, запись пользователя и ответ"""
+    return run_update_storm(args, 'messages', api,
+                            lambda i, user_id: message_update(i, user_id, 'hello'),
+                            lambda method, params: method == 'sendMessage')
+
+
+def scenario_callbacks(args, api):
+    """Шторм нажатий inline-кнопок"""
+    return run_update_storm(args, 'callbacks', api,
+                            lambda i, user_id: callback_update(i, user_id, 'information'),
+                            lambda method, params: method == 'editMessageText')
+
+
+def scenario_downloads(args, api):
+    """Шторм ссылок: очередь, singleflight, скачивание синтетических файлов и отправка"""
+    import downloader
+
+    media = FakeMediaServer()
+    FakeExtractor(media.url, args.video_size, args.video_delay, args.extract_delay,
+                  args.video_rate, args.fragments).install(downloader)
+    videos = [f'bench{i:06d}' for i in range(args.videos)]
+
+    def is_final(method, params):
+        return method == 'sendVideo' or ('❌' in params.get('text', '') and method in ('sendMessage', 'editMessageText'))
+
+    try:
+        return run_update_storm(args, 'downloads', api,
+                                lambda i, user_id: message_update(i, user_id, f'https://youtu.be/{videos[i % len(videos)]}'),
+                                is_final)
+    finally:
+        media.stop()
+
+
+class TimedBot:
+    """Обёртка над TeleBot, замеряющая длительность send_message (для сценария рассылки)"""
+
+    def __init__(self, bot):
+        self._bot = bot
+        self.latencies = []
+
+    def send_message(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return self._bot.send_message(*args, **kwargs)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+
+def scenario_broadcast(args, api):
+    """Рассылка N пользователям через Broadcaster"""
+    import config
+    from broadcast import Broadcaster
+    from database import db_manager
+
+    now = datetime.now().isoformat()
+    for i in range(args.n):
+        db_manager.save_user({'user_id': FIRST_USER_ID + i, 'first_name': f'User{i}',
+                              'first_interaction': now, 'last_interaction': now})
+    db_manager.flush()
+
+    import bot as bot_module
+    timed = TimedBot(bot_module.bot)
+    broadcaster = Broadcaster(timed, db_manager, rate=config.broadcast_rate, senders=config.broadcast_senders)
+
+    started = time.monotonic()
+    broadcaster.start(config.admin_ids[0], 'Bench broadcast')
+    for thread in broadcaster._threads:
+        thread.join(args.timeout)
+    seconds = time.monotonic() - started
+
+    state = db_manager.get_unfinished_broadcasts()
+    db_manager.close()
+    # count — число получателей; latencies включают повторы после 429 и итоговый отчёт админу
+    return [result('broadcast', args.n, seconds, timed.latencies,
+                   n=args.n, rate=config.broadcast_rate, senders=config.broadcast_senders,
+                   api_latency=args.api_latency, rate_limit_every=args.rate_limit_every,
+                   finished=not state)]
+
+
+def populate_database(path, rows, downloads_per_user=2):
+    """Быстро заполняет базу синтетическими пользователями и загрузками (в обход буфера)"""
+    from database import DatabaseManager
+
+    DatabaseManager(path).close()
+    conn = sqlite3.connect(path)
+    base = datetime(2024, 1, 1).timestamp()
+    batch = 10000
+
+    for start in range(0, rows, batch):
+        users = []
+        downloads = []
+        for i in range(start, min(start + batch, rows)):
+            user_id = FIRST_USER_ID + i
+            seen = datetime.fromtimestamp(base + i * 37).isoformat()
+            users.append((user_id, f'user{i}', f'User{i}', None, 'uk', 0, i % 10 == 0,
+                          seen, seen, downloads_per_user, 1))
+            for j in range(downloads_per_user):
+                downloads.append((user_id, f'https://youtu.be/bench{j:06d}', f'Bench video {j}',
+                                  datetime.utcfromtimestamp(base + i * 37 + j).strftime('%Y-%m-%d %H:%M:%S'),
+                                  1024 * 1024, 1, f'bench{j:06d}'))
+        conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', users)
+        conn.executemany('''
+            INSERT INTO downloads (user_id, video_url, video_title, download_time, file_size, success, video_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', downloads)
+        conn.commit()
+
+    # Счётчики и агрегаты пересчитаются при следующем открытии базы
+    conn.execute('DELETE FROM stats_counters')
+    conn.execute('DELETE FROM stats_rollups')
+    conn.commit()
+    conn.close()
+
+
+def timed_runs(func, repeat):
+    latencies = []
+    started = time.monotonic()
+    for _ in range(repeat):
+        op_started = time.monotonic()
+        func()
+        latencies.append(time.monotonic() - op_started)
+    return time.monotonic() - started, latencies
+
+
+def scenario_stats(args, api):
+    """Статистика и экспорт на базе из --rows пользователей"""
+    from database import DatabaseManager
+
+    started = time.monotonic()
+    populate_database('bench.db', args.rows)
+    populate_seconds = time.monotonic() - started
+
+    started = time.monotonic()
+    db = DatabaseManager('bench.db')
+    backfill_seconds = time.monotonic() - started
+
+    results = [result('stats.populate', args.rows, populate_seconds, [], rows=args.rows),
+               result('stats.backfill', 1, backfill_seconds, [backfill_seconds], rows=args.rows)]
+
+    seconds, latencies = timed_runs(db.get_statistics, args.repeat)
+    results.append(result('stats.get_statistics', args.repeat, seconds, latencies, rows=args.rows))
+
+    seconds, latencies = timed_runs(lambda: db.get_trends('hour', 24), args.repeat)
+    results.append(result('stats.get_trends', args.repeat, seconds, latencies, rows=args.rows))
+
+    seconds, _ = timed_runs(lambda: sum(1 for _ in db.iter_users(include_downloads=True)), 1)
+    results.append(result('stats.iter_users', args.rows, seconds, [], rows=args.rows))
+
+    os.mkdir('export')
+    seconds, _ = timed_runs(lambda: db.export_users('export', fmt='ndjson', compress=True), 1)
+    results.append(result('stats.export_users', args.rows, seconds, [], rows=args.rows))
+
+    seconds, _ = timed_runs(lambda: db.export_snapshot(mode='db', compress=False), 1)
+    results.append(result('stats.export_snapshot', args.rows, seconds, [], rows=args.rows))
+
+    db.close()
+    return results
+
+
+def run_worker(args):
+    """Выполняет один сценарий в текущем процессе (вызывается из run_all в подпроцессе)"""
+    overrides = {}
+    for item in args.set or []:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+
+    api = FakeBotAPI(latency=args.api_latency, rate_limit_every=args.rate_limit_every)
+    workdir = prepare_workdir(args, api.url, overrides)
+
+    import logging
+    # Лог бота в бенчмарке только мешает замерам
+    logging.disable(logging.WARNING)
+
+    try:
+        results = globals()[f'scenario_{args.worker}'](args, api)
+    finally:
+        api.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in results:
+        line['api_calls'] = dict(api.calls)
+        print(json.dumps(line, ensure_ascii=False), flush=True)
+    # Потоки пула telebot не завершаются сами
+    os._exit(0)
+
+
+def run_all(args, argv):
+    commit = git_commit()
+    scenarios = args.scenarios or SCENARIOS
+    passthrough = [a for a in argv if a not in scenarios]
+
+    with open(args.output, 'a', encoding='utf-8') as output:
+        for scenario in scenarios:
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', scenario, *passthrough],
+                                     capture_output=True, text=True, timeout=args.timeout * 4)
+            lines = [line for line in process.stdout.splitlines() if line.startswith('{')]
+            if process.returncode or not lines:
+                print(f'{scenario}: failed\n{process.stderr[-2000:]}', file=sys.stderr)
+                continue
+
+            for line in lines:
+                record = {'commit': commit, 'timestamp': datetime.now().isoformat(timespec='seconds'),
+                          'python': sys.version.split()[0], **json.loads(line)}
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                print(json.dumps(record, ensure_ascii=False))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description='Offline benchmarks with a fake Bot API and extractor')
+    parser.add_argument('scenarios', nargs='*', default=[],
+                        help=f'scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('--n', type=int, default=1000, help='updates / broadcast recipients')
+    parser.add_argument('--rows', type=int, default=10000, help='users in the stats database')
+    parser.add_argument('--repeat', type=int, default=50, help='repetitions of fast stats queries')
+    parser.add_argument('--videos', type=int, default=10, help='distinct videos in the downloads scenario')
+    parser.add_argument('--video-size', type=int, default=5 * 1024 * 1024, help='synthetic file size, bytes')
+    parser.add_argument('--video-delay', type=float, default=0.0, help='media time to first byte, seconds')
+    parser.add_argument('--video-rate', type=float, default=0,
+                        help='media throughput per connection, bytes/s (0 — unlimited)')
+    parser.add_argument('--fragments', type=int, default=0, help='serve videos as DASH with N fragments')
+    parser.add_argument('--extract-delay', type=float, default=0.0, help='fake metadata extraction time, seconds')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='fake Bot API response delay, seconds')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every N-th sendMessage with 429')
+    parser.add_argument('--webhook', action='store_true', help='deliver updates through WebhookServer')
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', help='override a settings.json value')
+    parser.add_argument('--timeout', type=float, default=300, help='per-scenario timeout, seconds')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'bench_output.txt'), help='JSON lines log')
+    parser.add_argument('--worker', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    if args.worker:
+        run_worker(args)
+    else:
+        run_all(args, argv)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,454 +1,971 @@
-import telebot
-from telebot.apihelper import ApiTelegramException
-import os
-import downloader
-import config
-import keyboards
-import json
-import logging
-from pathlib import Path
-from database import db_manager
-import yt_dlp
-
-# ВАЖНО: Для корректной работы проверки подписки нужны публичные каналы с @username
-# Или используйте числовые ID каналов, но тогда бот должен быть администратором этих каналов
-REQUIRED_CHANNELS = [
-    {"id": "-1002397757887", "name": "НАРОД | Робота Київ🇺🇦", "url": "https://t.me/+vPRsg7xEfb4yZWEy"},
-    {"id": "-1002400023551", "name": "НАРОД | Віддалена робота🇺🇦", "url": "https://t.me/+lB3HA50hyLIxNGNi"},
-    {"id": "-1002649530761", "name": "НАРОД | Робота Вишневе🇺🇦", "url": "https://t.me/+GfUSmrF1tLwyMGQ6"},
-]
-
-bot = telebot.TeleBot(config.token)
-adm_state = {}
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-
-def safe_text(text):
-    if text is None:
-        return ""
-    return str(text).encode("utf-8", "ignore").decode("utf-8")
-
-def extract_user_data(user):
-    """Извлекает данные пользователя из объекта Telegram User"""
-    return {
-        'user_id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'language_code': user.language_code,
-        'is_bot': user.is_bot,
-        'is_premium': getattr(user, 'is_premium', False)  # На случай если поле отсутствует
-    }
-
-def check_subscriptions(user_id):
-    """Проверяет подписки пользователя на все необходимые каналы"""
-    unsubscribed = []
-    
-    for channel in REQUIRED_CHANNELS:
-        try:
-            # Получаем информацию об участнике канала
-            member = bot.get_chat_member(channel['id'], user_id)
-            
-            logging.info(f"User {user_id} status in channel {channel['id']}: {member.status}")
-            
-            if member.status in ["left", "kicked"]:
-                logging.info(f"User {user_id} is not subscribed to {channel['name']}")
-                unsubscribed.append(channel)
-            else:
-                logging.info(f"User {user_id} is subscribed to {channel['name']}")
-                
-        except ApiTelegramException as e:
-            logging.warning(f"API Error while checking {channel['id']} for user {user_id}: {e}")
-            
-            if "user not found" in str(e).lower() or "not found" in str(e).lower():
-                logging.info(f"User {user_id} not found in channel {channel['name']} - not subscribed")
-                unsubscribed.append(channel)
-            elif "bot is not a member" in str(e).lower() or "forbidden" in str(e).lower():
-                logging.error(f"Bot is not admin in channel {channel['name']}. Cannot check subscription.")
-                unsubscribed.append(channel)
-            else:
-                logging.error(f"Unknown API error for channel {channel['name']}: {e}")
-                unsubscribed.append(channel)
-                
-        except Exception as e:
-            logging.error(f"Unexpected error while checking {channel['id']} for user {user_id}: {e}")
-            unsubscribed.append(channel)
-    
-    logging.info(f"User {user_id} unsubscribed channels: {len(unsubscribed)}")
-    return unsubscribed
-
-@bot.message_handler(commands=['start'])
-def start_command(message):
-    user_id = message.from_user.id
-    username = message.from_user.username or "Unknown"
-    logging.info(f"Start command from user {user_id} (@{username})")
-    
-    # Сохраняем полную информацию о пользователе
-    user_data = extract_user_data(message.from_user)
-    db_manager.save_user(user_data)
-    
-    unsubscribed = check_subscriptions(user_id)
-    if unsubscribed:
-        send_subscription_message(user_id, unsubscribed)
-    else:
-        bot.send_message(user_id, safe_text('*Добро пожаловать! Отправьте ссылку на YouTube видео для скачивания.*'), 
-                        parse_mode="markdown", reply_markup=keyboards.main_menu())
-
-def send_subscription_message(user_id, unsubscribed_channels):
-    text = "⚠️ *Для использования бота необходимо подписаться на все каналы:*\n\n"
-    markup = telebot.types.InlineKeyboardMarkup(row_width=1)
-    
-    for i, ch in enumerate(unsubscribed_channels, 1):
-        text += f"{i}. [{ch['name']}]({ch['url']})\n"
-        markup.add(telebot.types.InlineKeyboardButton(f"📢 {ch['name']}", url=ch['url']))
-    
-    text += "\n_После подписки на все каналы нажмите кнопку ниже:_"
-    markup.add(telebot.types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription"))
-    
-    try:
-        bot.send_message(user_id, safe_text(text), parse_mode="markdown", reply_markup=markup, disable_web_page_preview=True)
-    except Exception as e:
-        logging.error(f"Error sending subscription message: {e}")
-        # Fallback без markdown
-        simple_text = "Для использования бота необходимо подписаться на все каналы."
-        bot.send_message(user_id, simple_text, reply_markup=markup)
-
-@bot.message_handler(func=lambda message: True)
-def handle_message(message):
-    user_id = message.from_user.id
-    
-    # Сохраняем/обновляем пользователя в базе данных
-    user_data = extract_user_data(message.from_user)
-    db_manager.save_user(user_data)
-    
-    # Проверяем подписки
-    unsubscribed = check_subscriptions(user_id)
-    if unsubscribed:
-        send_subscription_message(user_id, unsubscribed)
-        return
-
-    # Обработка команд админа
-    if message.text == 'panda' and user_id in config.admin_ids:
-        bot.send_message(user_id, safe_text('🥰 *Привет, админ!*'), 
-                        parse_mode='markdown', reply_markup=keyboards.admin_menu())
-        return
-    
-    # Обработка состояний админа
-    if user_id in adm_state:
-        handle_admin_state(message, user_id)
-        return
-    
-    # Обработка YouTube ссылок
-    if 'youtube.com' in message.text.lower() or 'youtu.be' in message.text.lower():
-        download_youtube_video(message, user_id)
-    elif message.text == '⚙️ Главное меню':
-        bot.send_message(user_id, safe_text('*Главное меню*'), 
-                        parse_mode='markdown', reply_markup=keyboards.main_menu())
-    else:
-        bot.send_message(user_id, safe_text('*Отправьте ссылку на YouTube видео для скачивания.*'), 
-                        parse_mode='markdown', reply_markup=keyboards.main_menu())
-
-def handle_admin_state(message, user_id):
-    state = adm_state[user_id]
-    
-    if state['state'] == 'change':
-        try:
-            config.settings[state['who']] = message.text
-            with open('settings.json', 'w', encoding='utf-8') as f:
-                json.dump(config.settings, f, indent=4, ensure_ascii=False)
-            del adm_state[user_id]
-            bot.send_message(user_id, safe_text('*Настройка изменена!*'), 
-                           parse_mode='markdown', reply_markup=keyboards.admin_menu())
-        except Exception as e:
-            logging.error(f"Error saving settings: {e}")
-            bot.send_message(user_id, safe_text('❌ Ошибка при сохранении настроек.'))
-    
-    elif state['state'] == 'sendall':
-        good, bad = 0, 0
-        all_users = db_manager.get_all_users()
-        
-        for user in all_users:
-            try:
-                bot.send_message(user['user_id'], safe_text(message.text), parse_mode='markdown')
-                good += 1
-            except Exception as e:
-                logging.warning(f"Failed to send message to {user['user_id']}: {e}")
-                bad += 1
-        
-        del adm_state[user_id]
-        bot.send_message(user_id, safe_text(f'*Рассылка завершена:*\n✅ Доставлено: {good}\n❌ Не доставлено: {bad}'), 
-                        parse_mode='markdown', reply_markup=keyboards.admin_menu())
-
-def get_video_title(url):
-    """Получает название видео по URL"""
-    try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return info.get('title', 'Unknown')
-    except:
-        return 'Unknown'
-
-def download_youtube_video(message, user_id):
-    msg = bot.send_message(user_id, safe_text('⏳ _Идёт загрузка..._'), parse_mode='markdown')
-    download_obj = None
-    video_title = None
-    file_size = None
-    success = False
-    
-    try:
-        logging.info(f"Starting download for user {user_id}: {message.text}")
-        
-        # Получаем название видео
-        video_title = get_video_title(message.text)
-        
-        # Создаем объект загрузчика
-        download_obj = downloader.Download(message.text)
-        video_path = download_obj.file
-        
-        if not video_path or not os.path.exists(video_path):
-            raise FileNotFoundError("Файл не был загружен")
-        
-        # Проверяем размер файла
-        file_size = os.path.getsize(video_path)
-        if file_size > 50 * 1024 * 1024:  # 50MB
-            raise Exception("Файл слишком большой для отправки через Telegram")
-        
-        # Обновляем сообщение
-        bot.edit_message_text(safe_text('✅ _Готово! Отправляю файл..._'), 
-                             user_id, msg.message_id, parse_mode='markdown')
-        
-        # Отправляем файл
-        with open(video_path, 'rb') as video:
-            bot.send_video(
-                chat_id=message.chat.id,
-                video=video,
-                caption="Не встиг занудьгувати? \n\nНасолоджуйся, бро😎",
-                supports_streaming=True,  # Поддержка потокового воспроизведения
-                width=1920,  # Ширина видео (если известна)
-                height=1080,  # Высота видео (если известна)
-                duration=None  # Длительность (если известна)
-            )
-        
-        success = True
-        logging.info(f"Successfully sent video to user {user_id}")
-        
-        # Удаляем сообщение о загрузке
-        try:
-            bot.delete_message(user_id, msg.message_id)
-        except:
-            pass
-            
-    except Exception as e:
-        error_msg = str(e)
-        logging.error(f"Download error for user {user_id}: {error_msg}")
-        
-        try:
-            bot.edit_message_text(safe_text(f'❌ Помилка при скачуванні відео: {error_msg}'), 
-                                 user_id, msg.message_id)
-        except:
-            bot.send_message(user_id, safe_text(f'❌ Помилка при скачуванні відео: {error_msg}'))
-    
-    finally:
-        # Записываем информацию о загрузке в базу данных
-        db_manager.add_download(
-            user_id=user_id,
-            video_url=message.text,
-            video_title=video_title,
-            file_size=file_size,
-            success=success
-        )
-        
-        # Очищаем временные файлы
-        if download_obj:
-            try:
-                download_obj.cleanup()
-            except:
-                pass
-
-@bot.callback_query_handler(func=lambda call: True)
-def callbacks(call):
-    user_id = call.from_user.id
-    
-    try:
-        if call.data == 'check_subscription':
-            unsubscribed = check_subscriptions(user_id)
-            if unsubscribed:
-                bot.answer_callback_query(call.id, f"❌ Подпишитесь на все каналы!\nОсталось: {len(unsubscribed)}", show_alert=True)
-                # Обновляем сообщение с актуальным списком
-                send_subscription_message(user_id, unsubscribed)
-                try:
-                    bot.delete_message(user_id, call.message.message_id)
-                except:
-                    pass
-            else:
-                bot.answer_callback_query(call.id, "✅ Отлично! Добро пожаловать!")
-                bot.edit_message_text(safe_text('*🎉 Добро пожаловать!*\n\nТеперь вы можете пользоваться ботом.\nОтправьте ссылку на YouTube видео для скачивания.'), 
-                                    user_id, call.message.message_id, 
-                                    parse_mode='markdown', reply_markup=keyboards.main_menu())
-        
-        elif call.data == 'menu':
-            bot.edit_message_text(safe_text('*Главное меню*'), 
-                                user_id, call.message.message_id, 
-                                parse_mode='markdown', reply_markup=keyboards.main_menu())
-        
-        elif call.data == 'information':
-            bot.edit_message_text(safe_text('ℹ️ *Информация о боте*'), 
-                                user_id, call.message.message_id, 
-                                parse_mode='markdown', reply_markup=keyboards.information())
-        
-        # Админские callback'и
-        elif call.data in ['base_export_json', 'base_export_sql', 'base_settings', 'bot_statistics', 
-                          'change_channel_id', 'change_channel_url', 'sendall']:
-            handle_admin_callbacks(call)
-            
-    except Exception as e:
-        logging.error(f"Callback error: {e}")
-        bot.answer_callback_query(call.id, "Произошла ошибка")
-
-def handle_admin_callbacks(call):
-    user_id = call.from_user.id
-    
-    if user_id not in config.admin_ids:
-        bot.answer_callback_query(call.id, "❌ Доступ запрещен!")
-        return
-    
-    if call.data == 'base_export_json':
-        try:
-            # Экспортируем в JSON
-            json_file = db_manager.export_to_json()
-            
-            # Получаем статистику
-            stats = db_manager.get_statistics()
-            
-            with open(json_file, 'rb') as f:
-                bot.send_document(
-                    user_id, 
-                    f,
-                    caption=f"📊 *База пользователей (JSON)*\n\n"
-                           f"👥 Всего пользователей: {stats.get('total_users', 0)}\n"
-                           f"🔥 Активных: {stats.get('active_users', 0)}\n"
-                           f"📥 Всего загрузок: {stats.get('total_downloads', 0)}\n"
-                           f"✅ Успешных: {stats.get('successful_downloads', 0)}\n"
-                           f"📈 Успешность: {stats.get('success_rate', 0):.1f}%",
-                    parse_mode='markdown'
-                )
-            
-            # Удаляем временный файл
-            os.remove(json_file)
-            
-        except Exception as e:
-            logging.error(f"JSON export error: {e}")
-            bot.send_message(user_id, "❌ Ошибка при экспорте в JSON")
-    
-    elif call.data == 'base_export_sql':
-        try:
-            # Экспортируем в SQL
-            sql_file = db_manager.export_to_sql()
-            
-            if sql_file:
-                with open(sql_file, 'rb') as f:
-                    bot.send_document(
-                        user_id, 
-                        f,
-                        caption="🗄️ *Экспорт базы данных (SQL)*\n\nПолная копия базы данных со схемой и данными",
-                        parse_mode='markdown'
-                    )
-                
-                # Удаляем временный файл
-                os.remove(sql_file)
-            else:
-                bot.send_message(user_id, "❌ Ошибка при создании SQL экспорта")
-            
-        except Exception as e:
-            logging.error(f"SQL export error: {e}")
-            bot.send_message(user_id, "❌ Ошибка при экспорте в SQL")
-    
-    elif call.data == 'bot_statistics':
-        try:
-            stats = db_manager.get_statistics()
-            
-            stats_text = f"""📊 *Статистика бота*
-
-👥 *Пользователи:*
-• Всего: {stats.get('total_users', 0)}
-• Активных: {stats.get('active_users', 0)}
-
-📥 *Загрузки:*
-• Всего: {stats.get('total_downloads', 0)}
-• Успешных: {stats.get('successful_downloads', 0)}
-• Успешность: {stats.get('success_rate', 0):.1f}%
-
-🏆 *Топ пользователей:*"""
-
-            top_users = stats.get('top_users', [])
-            for i, user in enumerate(top_users[:5], 1):
-                name = user.get('first_name', '') or user.get('username', f"ID{user['user_id']}")
-                stats_text += f"\n{i}. {name} - {user['download_count']} загрузок"
-            
-            bot.send_message(user_id, safe_text(stats_text), parse_mode='markdown')
-            
-        except Exception as e:
-            logging.error(f"Statistics error: {e}")
-            bot.send_message(user_id, "❌ Ошибка при получении статистики")
-    
-    elif call.data == 'base_settings':
-        try:
-            settings_text = json.dumps(config.settings, indent=2, ensure_ascii=False)
-            
-            # Создаем временный файл
-            settings_file = f'settings_export_{user_id}.json'
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                f.write(settings_text)
-            
-            with open(settings_file, 'rb') as f:
-                bot.send_document(
-                    user_id,
-                    f,
-                    caption="⚙️ Текущие настройки бота"
-                )
-            
-            # Удаляем временный файл
-            os.remove(settings_file)
-            
-        except Exception as e:
-            logging.error(f"Settings export error: {e}")
-            bot.send_message(user_id, "❌ Ошибка при экспорте настроек")
-    
-    elif call.data == 'change_channel_id':
-        adm_state[user_id] = {'state': 'change', 'who': 'channel_id'}
-        bot.send_message(user_id, "Отправьте новый ID канала:")
-    
-    elif call.data == 'change_channel_url':
-        adm_state[user_id] = {'state': 'change', 'who': 'channel_url'}
-        bot.send_message(user_id, "Отправьте новую ссылку на канал:")
-    
-    elif call.data == 'sendall':
-        adm_state[user_id] = {'state': 'sendall'}
-        bot.send_message(user_id, "Отправьте сообщение для рассылки:")
-
-if __name__ == "__main__":
-    # Создаем необходимые папки
-    Path("downloads").mkdir(exist_ok=True)
-    
-    # Инициализируем базу данных
-    db_manager.init_database()
-    
-    logging.info("Bot starting...")
-    try:
-        bot.remove_webhook()
-        bot.infinity_polling(none_stop=True, timeout=10, long_polling_timeout=5)
-    except Exception as e:
-        logging.error(f"Bot crashed: {e}")
-        raise
\ No newline at end of file
+import telebot
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+import os
+import downloader
+import config
+import jobs
+from broadcast import Broadcaster
+from webhook import WebhookServer
+from storage import DownloadCache
+from progress import ProgressReporter
+from admission import AdmissionController, Rejected
+import metrics
+import keyboards
+import urls
+import contextvars
+import json
+import logging
+import logsetup
+import signal
+import threading
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+from database import db_manager
+from cache import TTLCache
+
+# ВАЖНО: Для корректной работы проверки подписки нужны публичные каналы с @username
+# Или используйте числовые ID каналов, но тогда бот должен быть администратором этих каналов
+REQUIRED_CHANNELS = [
+    {"id": "-1002397757887", "name": "НАРОД | Робота Київ🇺🇦", "url": "https://t.me/+vPRsg7xEfb4yZWEy"},
+    {"id": "-1002400023551", "name": "НАРОД | Віддалена робота🇺🇦", "url": "https://t.me/+lB3HA50hyLIxNGNi"},
+    {"id": "-1002649530761", "name": "НАРОД | Робота Вишневе🇺🇦", "url": "https://t.me/+GfUSmrF1tLwyMGQ6"},
+]
+
+# Собственный (в том числе локальный) сервер Bot API
+if config.bot_api_url:
+    apihelper.API_URL = config.bot_api_url.rstrip('/') + '/bot{0}/{1}'
+    apihelper.FILE_URL = config.bot_api_url.rstrip('/') + '/file/bot{0}/{1}'
+
+def count_rate_limits(check_result):
+    """Оборачивает проверку ответа Bot API: каждый 429 (из обработчиков, воркеров,
+    рассылок и правок прогресса) учитывается в bot_rate_limited_total по методу API"""
+    def wrapper(method_name, result):
+        try:
+            return check_result(method_name, result)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                metrics.rate_limited.labels(method_name).inc()
+            raise
+    return wrapper
+
+apihelper._check_result = count_rate_limits(apihelper._check_result)
+
+# В режиме webhook обработчики выполняют потоки-диспетчеры WebhookServer
+bot = telebot.TeleBot(config.token, threaded=not config.webhook_enabled)
+adm_state = {}
+
+# Кэш результатов get_chat_member: (user_id, channel_id) -> подписан ли
+subscription_cache = TTLCache(maxsize=config.subscription_cache_size, ttl=config.subscription_cache_ttl)
+# Общий пул для параллельной проверки каналов
+subscription_executor = ThreadPoolExecutor(max_workers=config.subscription_check_workers,
+                                           thread_name_prefix='subscription')
+
+# Настройка логирования: запись в файл и консоль выполняет фоновый поток
+logsetup.setup_logging(
+    level=config.log_level,
+    path=config.log_file,
+    max_bytes=config.log_max_bytes,
+    backup_count=config.log_backup_count,
+    rotate_when=config.log_rotate_when,
+    json_format=config.log_json,
+    sampled_loggers=['bot.subscriptions'],
+    sample_rate=config.log_sample_rate
+)
+# Подробности проверки каждого канала: уровень DEBUG и ограничение частоты
+subscription_log = logging.getLogger('bot.subscriptions')
+
+def safe_text(text):
+    if text is None:
+        return ""
+    return str(text).encode("utf-8", "ignore").decode("utf-8")
+
+def extract_user_data(user):
+    """Извлекает данные пользователя из объекта Telegram User"""
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'language_code': user.language_code,
+        'is_bot': user.is_bot,
+        'is_premium': getattr(user, 'is_premium', False)  # На случай если поле отсутствует
+    }
+
+def check_channel(channel, user_id):
+    """Проверяет подписку на один канал.
+
+    Возвращает пару (подписан, можно_кэшировать): сетевые и неизвестные
+    ошибки не кэшируются, чтобы временный сбой не блокировал пользователя.
+    """
+    try:
+        # Получаем информацию об участнике канала
+        member = bot.get_chat_member(channel['id'], user_id)
+        
+        subscription_log.debug(f"User {user_id} status in channel {channel['id']}: {member.status}")
+        return member.status not in ["left", "kicked"], True
+            
+    except ApiTelegramException as e:
+        logging.warning(f"API Error while checking {channel['id']} for user {user_id}: {e}")
+        
+        if "user not found" in str(e).lower() or "not found" in str(e).lower():
+            subscription_log.debug(f"User {user_id} not found in channel {channel['name']} - not subscribed")
+            return False, True
+        elif "bot is not a member" in str(e).lower() or "forbidden" in str(e).lower():
+            logging.error(f"Bot is not admin in channel {channel['name']}. Cannot check subscription.")
+            return False, False
+        else:
+            logging.error(f"Unknown API error for channel {channel['name']}: {e}")
+            return False, False
+            
+    except Exception as e:
+        logging.error(f"Unexpected error while checking {channel['id']} for user {user_id}: {e}")
+        return False, False
+
+def check_subscriptions(user_id):
+    """Проверяет подписки пользователя на все необходимые каналы"""
+    started = time.monotonic()
+    results = {}
+    pending = {}
+    
+    for channel in REQUIRED_CHANNELS:
+        subscribed = subscription_cache.get((user_id, channel['id']))
+        if subscribed is None:
+            # Промахи кэша проверяем параллельно — ожидание ≈ одному запросу к API
+            # copy_context передаёт request_id в поток пула
+            pending[subscription_executor.submit(contextvars.copy_context().run,
+                                                 check_channel, channel, user_id)] = channel
+        else:
+            results[channel['id']] = subscribed
+    
+    if pending:
+        done, not_done = wait(pending, timeout=config.subscription_check_timeout)
+        
+        for future in done:
+            channel = pending[future]
+            subscribed, cacheable = future.result()
+            results[channel['id']] = subscribed
+            if cacheable:
+                ttl = config.subscription_cache_ttl if subscribed else config.subscription_cache_negative_ttl
+                subscription_cache.set((user_id, channel['id']), subscribed, ttl=ttl)
+        
+        for future in not_done:
+            channel = pending[future]
+            logging.warning(f"Timeout while checking {channel['id']} for user {user_id}")
+            future.cancel()
+            results[channel['id']] = False
+    
+    # Сохраняем порядок каналов из REQUIRED_CHANNELS
+    unsubscribed = [channel for channel in REQUIRED_CHANNELS if not results[channel['id']]]
+    
+    metrics.observe('subscription_check', time.monotonic() - started)
+    logging.info(f"User {user_id} unsubscribed channels: {len(unsubscribed)}")
+    return unsubscribed
+
+def invalidate_subscriptions(user_id):
+    """Сбрасывает кэш подписок пользователя (кнопка «Проверить подписку»)"""
+    for channel in REQUIRED_CHANNELS:
+        subscription_cache.pop((user_id, channel['id']))
+
+@bot.message_handler(commands=['start'])
+def start_command(message):
+    user_id = message.from_user.id
+    logsetup.request_id.set(f"{user_id}:{message.message_id}")
+    username = message.from_user.username or "Unknown"
+    logging.info(f"Start command from user {user_id} (@{username})")
+    
+    # Сохраняем полную информацию о пользователе
+    user_data = extract_user_data(message.from_user)
+    db_manager.save_user(user_data)
+    
+    unsubscribed = check_subscriptions(user_id)
+    if unsubscribed:
+        send_subscription_message(user_id, unsubscribed)
+    else:
+        bot.send_message(user_id, safe_text('*Добро пожаловать! Отправьте ссылку на YouTube видео для скачивания.*'), 
+                        parse_mode="markdown", reply_markup=keyboards.main_menu())
+
+def build_subscription_message(unsubscribed_channels):
+    """Текст и клавиатура со списком каналов для подписки"""
+    text = "⚠️ *Для использования бота необходимо подписаться на все каналы:*\n\n"
+    markup = telebot.types.InlineKeyboardMarkup(row_width=1)
+    
+    for i, ch in enumerate(unsubscribed_channels, 1):
+        text += f"{i}. [{ch['name']}]({ch['url']})\n"
+        markup.add(telebot.types.InlineKeyboardButton(f"📢 {ch['name']}", url=ch['url']))
+    
+    text += "\n_После подписки на все каналы нажмите кнопку ниже:_"
+    markup.add(telebot.types.InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription"))
+    return text, markup
+
+def send_subscription_message(user_id, unsubscribed_channels):
+    text, markup = build_subscription_message(unsubscribed_channels)
+    
+    try:
+        bot.send_message(user_id, safe_text(text), parse_mode="markdown", reply_markup=markup, disable_web_page_preview=True)
+    except Exception as e:
+        logging.error(f"Error sending subscription message: {e}")
+        # Fallback без markdown
+        simple_text = "Для использования бота необходимо подписаться на все каналы."
+        bot.send_message(user_id, simple_text, reply_markup=markup)
+
+# Ссылки принимаются и из подписей к медиа, а не только из текста
+MESSAGE_CONTENT_TYPES = ['text', 'photo', 'video', 'document', 'animation']
+
+@bot.message_handler(func=lambda message: True, content_types=MESSAGE_CONTENT_TYPES)
+def handle_message(message):
+    user_id = message.from_user.id
+    logsetup.request_id.set(f"{user_id}:{message.message_id}")
+    
+    # Сохраняем/обновляем пользователя в базе данных
+    user_data = extract_user_data(message.from_user)
+    db_manager.save_user(user_data)
+    
+    # Проверяем подписки
+    unsubscribed = check_subscriptions(user_id)
+    if unsubscribed:
+        send_subscription_message(user_id, unsubscribed)
+        return
+
+    # Обработка команд админа
+    if message.text == 'panda' and user_id in config.admin_ids:
+        bot.send_message(user_id, safe_text('🥰 *Привет, админ!*'), 
+                        parse_mode='markdown', reply_markup=keyboards.admin_menu())
+        return
+    
+    # Обработка состояний админа (ожидается текст настройки или рассылки)
+    if user_id in adm_state and message.text is not None:
+        handle_admin_state(message, user_id)
+        return
+    
+    # Обработка YouTube ссылок (в том числе скрытых в тексте)
+    video_ids = urls.message_video_ids(message)
+    if video_ids:
+        download_youtube_video(message, user_id, video_ids)
+    elif message.text == '⚙️ Главное меню':
+        bot.send_message(user_id, safe_text('*Главное меню*'), 
+                        parse_mode='markdown', reply_markup=keyboards.main_menu())
+    else:
+        bot.send_message(user_id, safe_text('*Отправьте ссылку на YouTube видео для скачивания.*'), 
+                        parse_mode='markdown', reply_markup=keyboards.main_menu())
+
+def handle_admin_state(message, user_id):
+    state = adm_state[user_id]
+    
+    if state['state'] == 'change':
+        try:
+            config.settings[state['who']] = message.text
+            with open('settings.json', 'w', encoding='utf-8') as f:
+                json.dump(config.settings, f, indent=4, ensure_ascii=False)
+            del adm_state[user_id]
+            bot.send_message(user_id, safe_text('*Настройка изменена!*'), 
+                           parse_mode='markdown', reply_markup=keyboards.admin_menu())
+        except Exception as e:
+            logging.error(f"Error saving settings: {e}")
+            bot.send_message(user_id, safe_text('❌ Ошибка при сохранении настроек.'))
+    
+    elif state['state'] == 'sendall':
+        del adm_state[user_id]
+        # Рассылка идёт в фоне; прогресс обновляется в этом сообщении
+        msg = bot.send_message(user_id, safe_text('🔊 _Рассылка запущена..._'), parse_mode='markdown')
+        try:
+            broadcaster.start(user_id, safe_text(message.text), msg.message_id)
+        except Exception as e:
+            logging.error(f"Broadcast start error: {e}")
+            bot.send_message(user_id, safe_text('❌ Ошибка при запуске рассылки.'), 
+                            reply_markup=keyboards.admin_menu())
+
+def admit_download(message, user_id, batch):
+    """Контроль допуска: возвращает текст отказа или None. Отказ записывается в базу.
+    
+    Каждая ссылка пакета расходует токен лимита частоты; пакет занимает столько
+    слотов одновременных загрузок, сколько его задач стоит в очереди одновременно.
+    """
+    try:
+        batch.parallelism = admission.admit(message.from_user, links=len(batch.jobs), slots=batch.parallelism)
+        return None
+    except Rejected as e:
+        logging.warning(f"Download rejected for user {user_id}: {e.reason}")
+        for job in batch.jobs:
+            db_manager.add_download(user_id=user_id, video_url=job.url, success=False,
+                                    reject_reason=e.reason, video_id=job.video_id)
+        return str(e)
+
+def prepare_batch(message, user_id, video_ids):
+    """Пакет задач по ссылкам сообщения.
+    
+    Ссылки сверх max_links_per_message и запаса burst тарифа отбрасываются,
+    параллельность пакета не превышает лимита одновременных загрузок тарифа.
+    """
+    limits = admission.limits_for(message.from_user)
+    batch = jobs.Batch(min(config.batch_parallelism, limits['concurrent']))
+    for video_id in video_ids[:min(config.max_links_per_message, limits['burst'])]:
+        batch.add(jobs.DownloadJob(message, user_id, urls.canonical_url(video_id), video_id))
+    return batch, len(video_ids) - len(batch.jobs)
+
+def submit_batch(batch):
+    """Ставит в очередь очередные задачи пакета (не больше batch_parallelism одновременно).
+    
+    При переполнении очереди отклоняются и все ещё не поставленные задачи пакета.
+    Возвращает (поставленные, отклонённые); отклонённые уже записаны в базу.
+    """
+    submitted, rejected = [], []
+    for job in batch.take():
+        job.position = download_queue.submit(job)
+        (rejected if job.position is None else submitted).append(job)
+    if not rejected:
+        return submitted, rejected
+    
+    done = False
+    for job in rejected:
+        done = batch.finish() or done
+    cancelled, cancelled_done = batch.cancel()
+    rejected += cancelled
+    
+    logging.warning(f"Download queue is full, rejecting {len(rejected)} links of user {rejected[0].user_id}")
+    for job in rejected:
+        db_manager.add_download(user_id=job.user_id, video_url=job.url, success=False,
+                                reject_reason='queue_full', video_id=job.video_id)
+    if done or cancelled_done:
+        admission.release(rejected[0].user_id, batch.parallelism)
+    return submitted, rejected
+
+def queue_full_text():
+    stats = download_queue.stats()
+    return safe_text(f'❌ Черга переповнена ({stats["depth"]} відео). Спробуйте пізніше.')
+
+def notify_submitted(submitted, rejected):
+    """Сообщает позиции в очереди и отказы по переполнению"""
+    for job in submitted:
+        if job.position:
+            bot.edit_message_text(safe_text(f'⏳ _Ви в черзі: позиція {job.position}_'), 
+                                 job.chat_id, job.status_message_id, parse_mode='markdown')
+    for job in rejected:
+        bot.edit_message_text(queue_full_text(), job.chat_id, job.status_message_id)
+
+def complete_batch_job(job):
+    """Задача пакета завершена: ставим следующую ссылку или освобождаем допуск"""
+    if job.batch.finish():
+        admission.release(job.user_id, job.batch.parallelism)
+        return
+    try:
+        notify_submitted(*submit_batch(job.batch))
+    except Exception as e:
+        logging.error(f"Batch notification failed for user {job.user_id}: {e}")
+
+def download_youtube_video(message, user_id, video_ids):
+    """Ставит ссылки из сообщения в очередь одним пакетом; сам обработчик возвращается сразу"""
+    batch, skipped = prepare_batch(message, user_id, video_ids)
+    rejection = admit_download(message, user_id, batch)
+    if rejection:
+        bot.send_message(user_id, safe_text(f'❌ {rejection}'))
+        return
+    
+    if skipped:
+        bot.send_message(user_id, safe_text(f'⚠️ За раз обробляю не більше {len(batch.jobs)} посилань, '
+                                            f'решту ({skipped}) пропущено.'))
+    
+    # У каждой ссылки своё сообщение о статусе
+    try:
+        for job in batch.jobs:
+            msg = bot.send_message(user_id, safe_text('⏳ _Идёт загрузка..._'), parse_mode='markdown')
+            job.status_message_id = msg.message_id
+    except Exception:
+        admission.release(user_id, batch.parallelism)
+        raise
+    
+    notify_submitted(*submit_batch(batch))
+
+def process_download(job):
+    """Этап скачивания: выполняется в пуле download-воркеров"""
+    user_id = job.user_id
+    logging.info(f"Starting download for user {user_id}: {job.url}")
+    
+    if job.position:
+        try:
+            bot.edit_message_text(safe_text('⏳ _Идёт загрузка..._'), 
+                                 user_id, job.status_message_id, parse_mode='markdown')
+        except Exception:
+            pass
+    
+    # Видео уже отправлялось под тот же лимит размера — не извлекаем метаданные и не скачиваем
+    if not job.retried and job.video_id:
+        cached = db_manager.find_file_id(job.video_id, config.max_file_size)
+        if cached:
+            metrics.file_id_lookups.labels('hit').inc()
+            job.format_id, job.file_id, job.file_size, job.video_title = cached
+            logging.info(f"Serving {job.video_id} ({job.format_id}) from file_id cache without extraction")
+            return
+    
+    # Метаданные извлекаются один раз и используются и для названия, и для загрузки
+    with job.stage('extract'):
+        job.info = info = downloader.extract_info(job.url)
+        job.video_title = info.get('title', 'Unknown')
+        job.video_id = info.get('id') or job.video_id
+        job.format_id, job.estimated_size = downloader.select_format(info)
+    
+    # Видео уже отправлялось — повторно не скачиваем, отправим по file_id
+    if not job.retried:
+        job.file_id = db_manager.get_file_id(job.video_id, job.format_id)
+        metrics.file_id_lookups.labels('hit' if job.file_id else 'miss').inc()
+        if job.file_id:
+            logging.info(f"Serving {job.video_id} ({job.format_id}) from file_id cache")
+            return
+    
+    # Одновременные запросы одного и того же видео объединяются в одну загрузку
+    job.flight, leader = inflight.join((job.video_id, job.format_id))
+    if not leader:
+        if not inflight.attach(job.flight, job):
+            logging.info(f"User {user_id} is waiting for in-flight download of {job.video_id}")
+            # Ожидающий видит тот же прогресс, что и лидер
+            if job.flight.progress:
+                job.flight.progress.add_target(job.chat_id, job.status_message_id)
+            raise jobs.Deferred()
+        if job.flight.error:
+            raise job.flight.error
+        job.file_size = job.flight.file_size
+        return
+    
+    job.flight.progress = progress_reporter.tracker(job.chat_id, job.status_message_id, job.timings)
+    try:
+        download_flight(job)
+    except Exception as e:
+        for waiter in inflight.complete(job.flight, error=e):
+            download_queue.fail(waiter, e)
+        raise
+    
+    for waiter in inflight.complete(job.flight):
+        waiter.file_size = job.file_size
+        download_queue.resume(waiter)
+    
+    # Обновляем сообщение
+    bot.edit_message_text(safe_text('✅ _Готово! Отправляю файл..._'), 
+                         user_id, job.status_message_id, parse_mode='markdown')
+
+def download_flight(job):
+    """Скачивает файл для лидера общей загрузки (или берёт готовый из кэша загрузок)"""
+    flight = job.flight
+    
+    flight.file = download_cache.acquire(flight.key)
+    if flight.file:
+        logging.info(f"Serving {job.video_id} ({job.format_id}) from download cache")
+    else:
+        if not download_cache.admit(job.estimated_size):
+            raise Exception("Недостаточно места на сервере, попробуйте позже")
+        
+        # Создаем объект загрузчика; хуки обновляют сообщение о статусе
+        with job.stage('download'):
+            download_obj = downloader.Download(job.url, info=job.info, format_id=job.format_id,
+                                               output_template=download_cache.output_template(flight.key),
+                                               progress_hooks=[flight.progress.progress_hook],
+                                               postprocessor_hooks=[flight.progress.postprocessor_hook])
+        
+        if not download_obj.file or not os.path.exists(download_obj.file):
+            raise FileNotFoundError("Файл не был загружен")
+        flight.file = download_cache.add(flight.key, download_obj.file)
+        metrics.bytes_total.labels('download').inc(os.path.getsize(flight.file))
+    
+    # Проверяем размер файла
+    job.file_size = flight.file_size = os.path.getsize(flight.file)
+    if job.file_size > config.max_file_size:
+        # Такой файл всё равно не отправить — не держим его в кэше
+        download_cache.discard(flight.key)
+        raise Exception("Файл слишком большой для отправки через Telegram")
+
+def send_video_file(job, video):
+    """Отправляет видео (файл или file_id) и возвращает сообщение Telegram"""
+    return bot.send_video(
+        chat_id=job.chat_id,
+        video=video,
+        caption="Не встиг занудьгувати? \n\nНасолоджуйся, бро😎",
+        supports_streaming=True,  # Поддержка потокового воспроизведения
+        width=1920,  # Ширина видео (если известна)
+        height=1080,  # Высота видео (если известна)
+        duration=None  # Длительность (если известна)
+    )
+
+def is_file_error(error):
+    """Ошибка 4xx, в которой Bot API сообщает о проблеме с файлом или путём к нему"""
+    description = (error.description or '').lower()
+    return (400 <= error.error_code < 500 and error.error_code != 429 and
+            any(word in description for word in ('file', 'url', 'path')))
+
+def upload_video_file(job, video_path):
+    """Отправляет файл с диска.
+    
+    С локальным Bot API сервером передаётся только путь file://, и файл читает
+    сам сервер. Если сервер не смог прочитать файл (ошибка 4xx о файле или пути),
+    выполняется обычная multipart-загрузка. При прочих ошибках, например таймауте,
+    сервер мог уже принять видео — повтор отправил бы его дважды.
+    """
+    if config.local_bot_api:
+        local_path = Path(video_path).resolve()
+        if config.local_bot_api_downloads_dir:
+            # Путь к downloads/ так, как его видит сервер (например, внутри контейнера)
+            local_path = Path(config.local_bot_api_downloads_dir) / local_path.name
+        try:
+            return send_video_file(job, local_path.as_uri())
+        except ApiTelegramException as e:
+            if not is_file_error(e):
+                raise
+            logging.warning(f"Local Bot API upload of {video_path} failed, falling back to multipart: {e}")
+    
+    # Отправляем файл
+    with open(video_path, 'rb') as video:
+        return send_video_file(job, video)
+
+def process_upload(job):
+    """Этап отправки: выполняется в пуле upload-воркеров"""
+    user_id = job.user_id
+    
+    with job.stage('upload'):
+        send_upload(job)
+    
+    job.success = True
+    logging.info(f"Successfully sent video to user {user_id}")
+    
+    # Удаляем сообщение о загрузке
+    try:
+        bot.delete_message(user_id, job.status_message_id)
+    except:
+        pass
+
+def send_upload(job):
+    """Отправляет видео по file_id или файлом из общей загрузки"""
+    if job.file_id:
+        try:
+            send_video_file(job, job.file_id)
+        except ApiTelegramException as e:
+            # file_id устарел или недоступен — удаляем и скачиваем заново
+            logging.warning(f"Cached file_id for {job.video_id} failed: {e}")
+            db_manager.delete_file_id(job.video_id, job.format_id)
+            job.file_id = None
+            job.retried = True
+            raise jobs.RetryDownload()
+    else:
+        flight = job.flight
+        with flight.upload_lock:
+            if flight.file_id:
+                # Файл уже загружен в Telegram другим участником общей загрузки
+                send_video_file(job, flight.file_id)
+            else:
+                sent = upload_video_file(job, flight.file)
+                metrics.bytes_total.labels('upload').inc(job.file_size or 0)
+                
+                # Запоминаем file_id, чтобы следующие запросы обходились без загрузки
+                if sent.video and job.video_id:
+                    flight.file_id = sent.video.file_id
+                    db_manager.save_file_id(job.video_id, job.format_id, flight.file_id, job.file_size,
+                                            max_bytes=config.max_file_size, title=job.video_title)
+
+def finish_download(job, error):
+    """Завершение задачи: сообщение об ошибке, запись в базу и очистка.
+    
+    Запись в базу и освобождение допуска и кэша выполняются всегда — даже если
+    Telegram недоступен и сообщить об ошибке не удалось.
+    """
+    user_id = job.user_id
+    
+    try:
+        if error:
+            error_msg = str(error)
+            logging.error(f"Download error for user {user_id}: {error_msg}")
+            
+            try:
+                bot.edit_message_text(safe_text(f'❌ Помилка при скачуванні відео: {error_msg}'), 
+                                     user_id, job.status_message_id)
+            except Exception:
+                try:
+                    bot.send_message(user_id, safe_text(f'❌ Помилка при скачуванні відео: {error_msg}'))
+                except Exception as e:
+                    logging.warning(f"Could not notify user {user_id} about download error: {e}")
+        
+        for stage, seconds in job.timings.items():
+            metrics.observe(stage, seconds)
+        if job.timings:
+            # merge входит в download: склейка выполняется внутри yt-dlp
+            logging.info(f"Job timings for user {user_id} ({job.video_id}): " +
+                         ' '.join(f"{stage}={seconds:.2f}s" for stage, seconds in job.timings.items()))
+        
+        # Записываем информацию о загрузке в базу данных
+        db_manager.add_download(
+            user_id=user_id,
+            video_url=job.url,
+            video_title=job.video_title,
+            file_size=job.file_size,
+            success=job.success,
+            estimated_size=job.estimated_size,
+            video_id=job.video_id
+        )
+    finally:
+        complete_batch_job(job)
+        
+        # Открепляем файл в кэше загрузок, когда обслужен последний участник общей загрузки
+        if job.flight:
+            flight, job.flight = job.flight, None
+            if inflight.release(flight) and flight.file:
+                download_cache.release(flight.key)
+
+inflight = jobs.SingleFlight()
+
+admission = AdmissionController(
+    config.admission_tiers,
+    max_concurrent=config.max_concurrent_downloads,
+    admin_ids=config.admin_ids
+)
+
+progress_reporter = ProgressReporter(
+    lambda chat_id, message_id, text: bot.edit_message_text(safe_text(text), chat_id, message_id),
+    min_interval=config.progress_update_interval,
+    rate=config.progress_edit_rate
+)
+
+download_cache = DownloadCache(
+    directory='downloads',
+    max_bytes=config.download_cache_max_bytes,
+    ttl=config.download_cache_ttl,
+    min_free_bytes=config.download_min_free_bytes
+)
+
+broadcaster = Broadcaster(
+    bot, db_manager,
+    rate=config.broadcast_rate,
+    senders=config.broadcast_senders,
+    progress_interval=config.broadcast_progress_interval
+)
+
+stage_snapshotter = metrics.StageSnapshotter(db_manager.save_stage_latency,
+                                             interval=config.metrics_snapshot_interval)
+
+download_queue = jobs.JobQueue(
+    process_download, process_upload, finish_download,
+    max_size=config.download_queue_size,
+    download_workers=config.download_workers,
+    upload_workers=config.upload_workers
+)
+
+# Метрики, значения которых берутся из самих очередей и кэшей
+metrics.registry.callback('bot_queue_jobs', 'Download jobs by state', 'gauge', lambda: {
+    (state,): download_queue.stats()[state] for state in ('depth', 'active', 'uploads')
+}, labelnames=('state',))
+metrics.registry.callback('bot_admitted_downloads', 'Downloads holding an admission slot', 'gauge',
+                          lambda: {(): admission.stats()['active']})
+metrics.registry.callback('bot_cache_hits_total', 'Cache hits', 'counter', lambda: {
+    ('subscription',): subscription_cache.hits,
+    ('info',): downloader.info_cache.hits,
+    ('download',): download_cache.hits,
+}, labelnames=('cache',))
+metrics.registry.callback('bot_cache_misses_total', 'Cache misses', 'counter', lambda: {
+    ('subscription',): subscription_cache.misses,
+    ('info',): downloader.info_cache.misses,
+    ('download',): download_cache.misses,
+}, labelnames=('cache',))
+
+STAGE_NAMES = {
+    'queue': 'Очередь',
+    'subscription_check': 'Проверка подписки',
+    'extract': 'Метаданные',
+    'download': 'Скачивание',
+    'merge': 'Склейка',
+    'upload': 'Отправка',
+    'db_write': 'Запись в базу',
+}
+
+def hit_rate(hits, misses):
+    return f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "—"
+
+def performance_report():
+    """Раздел статистики о производительности: перцентили этапов, очередь и счётчики"""
+    live = metrics.stage_percentiles()
+    # После перезапуска окно пустое — показываем последний сохранённый снимок
+    saved = db_manager.get_stage_latency(limit=1) if len(live) < len(STAGE_NAMES) else {}
+    
+    text = "\n\n⏱ *Производительность (p50 / p90 / p99, сек):*"
+    for stage, name in STAGE_NAMES.items():
+        if stage in live:
+            p50, p90, p99 = live[stage][0.5], live[stage][0.9], live[stage][0.99]
+        elif stage in saved:
+            p50, p90, p99 = saved[stage][0]['p50'], saved[stage][0]['p90'], saved[stage][0]['p99']
+        else:
+            continue
+        text += f"\n• {name}: {p50:.2f} / {p90:.2f} / {p99:.2f}"
+    
+    queue = download_queue.stats()
+    file_id_hits = metrics.file_id_lookups.labels('hit').value
+    file_id_misses = metrics.file_id_lookups.labels('miss').value
+    rate_limited = sum(counter.value for _, counter in metrics.rate_limited.items())
+    downloaded = metrics.bytes_total.labels('download').value
+    uploaded = metrics.bytes_total.labels('upload').value
+    
+    text += (f"\n\n📦 Очередь: {queue['depth']} ждут, {queue['active']} скачиваются, {queue['uploads']} отправляются"
+             f"\n🎯 Кэши: подписки {hit_rate(subscription_cache.hits, subscription_cache.misses)}, "
+             f"метаданные {hit_rate(downloader.info_cache.hits, downloader.info_cache.misses)}, "
+             f"file\\_id {hit_rate(file_id_hits, file_id_misses)}, "
+             f"файлы {hit_rate(download_cache.hits, download_cache.misses)}"
+             f"\n🚦 Ответов 429: {rate_limited}"
+             f"\n💾 Скачано {downloaded / 1024 ** 3:.2f} ГБ, отправлено {uploaded / 1024 ** 3:.2f} ГБ")
+    return text
+
+def start_metrics():
+    """Запускает сохранение перцентилей этапов и, если включён, эндпоинт /metrics"""
+    stage_snapshotter.start()
+    if not config.metrics_enabled:
+        return None
+    server = metrics.MetricsServer(host=config.metrics_host, port=config.metrics_port)
+    server.start()
+    return server
+
+def stop_metrics(server):
+    if server:
+        server.stop()
+    stage_snapshotter.stop(timeout=5)
+
+@bot.callback_query_handler(func=lambda call: True)
+def callbacks(call):
+    user_id = call.from_user.id
+    logsetup.request_id.set(f"{user_id}:cb{call.id}")
+    
+    try:
+        if call.data == 'check_subscription':
+            invalidate_subscriptions(user_id)
+            unsubscribed = check_subscriptions(user_id)
+            if unsubscribed:
+                bot.answer_callback_query(call.id, f"❌ Подпишитесь на все каналы!\nОсталось: {len(unsubscribed)}", show_alert=True)
+                # Обновляем сообщение с актуальным списком
+                send_subscription_message(user_id, unsubscribed)
+                try:
+                    bot.delete_message(user_id, call.message.message_id)
+                except:
+                    pass
+            else:
+                bot.answer_callback_query(call.id, "✅ Отлично! Добро пожаловать!")
+                bot.edit_message_text(safe_text('*🎉 Добро пожаловать!*\n\nТеперь вы можете пользоваться ботом.\nОтправьте ссылку на YouTube видео для скачивания.'), 
+                                    user_id, call.message.message_id, 
+                                    parse_mode='markdown', reply_markup=keyboards.main_menu())
+        
+        elif call.data == 'menu':
+            bot.edit_message_text(safe_text('*Главное меню*'), 
+                                user_id, call.message.message_id, 
+                                parse_mode='markdown', reply_markup=keyboards.main_menu())
+        
+        elif call.data == 'information':
+            bot.edit_message_text(safe_text('ℹ️ *Информация о боте*'), 
+                                user_id, call.message.message_id, 
+                                parse_mode='markdown', reply_markup=keyboards.information())
+        
+        # Админские callback'и
+        elif call.data in ['base_export_json', 'base_export_sql', 'base_settings', 'bot_statistics', 
+                          'change_channel_id', 'change_channel_url', 'sendall']:
+            handle_admin_callbacks(call)
+            
+    except Exception as e:
+        logging.error(f"Callback error: {e}")
+        bot.answer_callback_query(call.id, "Произошла ошибка")
+
+def export_caption(fmt, compress, part, parts):
+    """Подпись к части экспорта: формат и сжатие, номер части — если частей несколько"""
+    kind = fmt.upper() + (', gzip' if compress else '')
+    caption = f"📊 *База пользователей ({kind})*"
+    if parts > 1:
+        caption += f" — часть {part}/{parts}"
+    return caption
+
+def handle_admin_callbacks(call):
+    user_id = call.from_user.id
+    
+    if user_id not in config.admin_ids:
+        bot.answer_callback_query(call.id, "❌ Доступ запрещен!")
+        return
+    
+    if call.data == 'base_export_json':
+        parts = []
+        try:
+            # Экспортируем в JSON потоково, частями не больше лимита документа
+            parts = db_manager.export_users(fmt=config.export_format, compress=config.export_compress)
+            
+            # Получаем статистику
+            stats = db_manager.get_statistics()
+            
+            for i, part in enumerate(parts, 1):
+                caption = export_caption(config.export_format, config.export_compress, i, len(parts))
+                if i == 1:
+                    caption += (f"\n\n👥 Всего пользователей: {stats.get('total_users', 0)}\n"
+                               f"🔥 Активных: {stats.get('active_users', 0)}\n"
+                               f"📥 Всего загрузок: {stats.get('total_downloads', 0)}\n"
+                               f"✅ Успешных: {stats.get('successful_downloads', 0)}\n"
+                               f"📈 Успешность: {stats.get('success_rate', 0):.1f}%")
+                
+                with open(part, 'rb') as f:
+                    bot.send_document(user_id, f, caption=caption, parse_mode='markdown')
+            
+        except Exception as e:
+            logging.error(f"JSON export error: {e}")
+            bot.send_message(user_id, "❌ Ошибка при экспорте в JSON")
+        
+        finally:
+            # Удаляем временные файлы
+            for part in parts:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+    
+    elif call.data == 'base_export_sql':
+        try:
+            # Экспортируем снимок базы (backup API), не блокируя рабочую базу
+            result = db_manager.export_snapshot(mode=config.sql_export_mode, compress=config.export_compress)
+            
+            if result:
+                with open(result['path'], 'rb') as f:
+                    bot.send_document(
+                        user_id, 
+                        f,
+                        caption="🗄️ *Экспорт базы данных (SQL)*\n\nПолная копия базы данных со схемой и данными\n"
+                               f"⏱ {result['seconds']:.1f} с, {result['throughput']:.1f} МБ/с",
+                        parse_mode='markdown'
+                    )
+                
+                # Удаляем временный файл
+                os.remove(result['path'])
+            else:
+                bot.send_message(user_id, "❌ Ошибка при создании SQL экспорта")
+            
+        except Exception as e:
+            logging.error(f"SQL export error: {e}")
+            bot.send_message(user_id, "❌ Ошибка при экспорте в SQL")
+    
+    elif call.data == 'bot_statistics':
+        try:
+            stats = db_manager.get_statistics()
+            
+            # Причины отказов контроля допуска (подписи без «_», чтобы не ломать markdown)
+            reasons = {'user_concurrency': 'лимит одновременных', 'rate_limit': 'частота запросов',
+                       'global_concurrency': 'общий потолок', 'queue_full': 'очередь полна'}
+            rejections = ''.join(f"\n   – {reasons.get(reason, 'другое')}: {count}"
+                                 for reason, count in stats.get('rejections', {}).items())
+            
+            stats_text = f"""📊 *Статистика бота*
+
+👥 *Пользователи:*
+• Всего: {stats.get('total_users', 0)}
+• Активных: {stats.get('active_users', 0)}
+
+📥 *Загрузки:*
+• Всего: {stats.get('total_downloads', 0)}
+• Успешных: {stats.get('successful_downloads', 0)}
+• Успешность: {stats.get('success_rate', 0):.1f}%
+• Отклонено: {stats.get('rejected_downloads', 0)}{rejections}
+
+🏆 *Топ пользователей:*"""
+
+            top_users = stats.get('top_users', [])
+            for i, user in enumerate(top_users[:5], 1):
+                name = user.get('first_name', '') or user.get('username', f"ID{user['user_id']}")
+                stats_text += f"\n{i}. {name} - {user['download_count']} загрузок"
+            
+            daily = stats.get('daily', [])
+            if daily:
+                stats_text += "\n\n📅 *По дням (UTC):*"
+                for day in daily:
+                    stats_text += f"\n• {day['bucket']}: +{day['new_users']} польз., {day['downloads']} загрузок"
+            
+            stats_text += performance_report()
+            
+            bot.send_message(user_id, safe_text(stats_text), parse_mode='markdown')
+            
+        except Exception as e:
+            logging.error(f"Statistics error: {e}")
+            bot.send_message(user_id, "❌ Ошибка при получении статистики")
+    
+    elif call.data == 'base_settings':
+        try:
+            settings_text = json.dumps(config.settings, indent=2, ensure_ascii=False)
+            
+            # Создаем временный файл
+            settings_file = f'settings_export_{user_id}.json'
+            with open(settings_file, 'w', encoding='utf-8') as f:
+                f.write(settings_text)
+            
+            with open(settings_file, 'rb') as f:
+                bot.send_document(
+                    user_id,
+                    f,
+                    caption="⚙️ Текущие настройки бота"
+                )
+            
+            # Удаляем временный файл
+            os.remove(settings_file)
+            
+        except Exception as e:
+            logging.error(f"Settings export error: {e}")
+            bot.send_message(user_id, "❌ Ошибка при экспорте настроек")
+    
+    elif call.data == 'change_channel_id':
+        adm_state[user_id] = {'state': 'change', 'who': 'channel_id'}
+        bot.send_message(user_id, "Отправьте новый ID канала:")
+    
+    elif call.data == 'change_channel_url':
+        adm_state[user_id] = {'state': 'change', 'who': 'channel_url'}
+        bot.send_message(user_id, "Отправьте новую ссылку на канал:")
+    
+    elif call.data == 'sendall':
+        adm_state[user_id] = {'state': 'sendall'}
+        bot.send_message(user_id, "Отправьте сообщение для рассылки:")
+
+def run_webhook():
+    """Принимает обновления через webhook до SIGINT/SIGTERM"""
+    server = WebhookServer(
+        bot,
+        host=config.webhook_host,
+        port=config.webhook_port,
+        path=config.webhook_path,
+        secret_token=config.webhook_secret,
+        queue_size=config.webhook_queue_size,
+        workers=config.webhook_workers
+    )
+    server.start()
+    
+    if config.webhook_url:
+        bot.remove_webhook()
+        bot.set_webhook(url=config.webhook_url, secret_token=config.webhook_secret or None,
+                        max_connections=config.webhook_workers)
+    
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info("Stopping webhook server, draining pending updates...")
+        server.stop(timeout=30)
+
+if __name__ == "__main__":
+    # Создаем папку загрузок и убираем остатки после аварийного завершения
+    download_cache.recover()
+    
+    # Инициализируем базу данных
+    db_manager.init_database()
+    
+    # Запускаем воркеры загрузок и продолжаем прерванные рассылки
+    download_queue.start()
+    broadcaster.resume_all()
+    metrics_server = start_metrics()
+    
+    logging.info("Bot starting...")
+    try:
+        if config.webhook_enabled:
+            run_webhook()
+        else:
+            bot.remove_webhook()
+            bot.infinity_polling(none_stop=True, timeout=10, long_polling_timeout=5)
+    except Exception as e:
+        logging.error(f"Bot crashed: {e}")
+        raise
+    finally:
+        broadcaster.stop(timeout=10)
+        download_queue.stop(timeout=60)
+        stop_metrics(metrics_server)
+        db_manager.close()
\ No newline at end of file
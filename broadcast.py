@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telebot.apihelper import ApiTelegramException
+import keyboards
+from ratelimit import TokenBucket
+
+
+class Broadcaster:
+    """Фоновая рассылка с общим ограничением скорости и сохранением прогресса.
+
+    Пользователи обходятся порциями по user_id; после каждой порции курсор и
+    счётчики пишутся в таблицу broadcasts, поэтому прерванная рассылка
+    продолжается с места остановки (повторно получит сообщение не больше одной порции).
+    """
+
+    def __init__(self, bot, db, rate=25, senders=8, chunk_size=100,
+                 progress_interval=5, max_retries=3):
+        self.bot = bot
+        self.db = db
+        self.senders = senders
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+        # Глобальный лимит Telegram — около 30 сообщений в секунду на бота
+        self.bucket = TokenBucket(rate)
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self, admin_id, text, progress_message_id=None):
+        """Запускает новую рассылку и возвращает её ID"""
+        total = self.db.count_users(active_only=True)
+        broadcast_id = self.db.create_broadcast(admin_id, text, total, progress_message_id)
+        if broadcast_id is None:
+            raise RuntimeError("Не удалось создать рассылку")
+
+        self._spawn({
+            'id': broadcast_id,
+            'admin_id': admin_id,
+            'text': text,
+            'last_user_id': None,
+            'total': total,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'progress_message_id': progress_message_id,
+        })
+        return broadcast_id
+
+    def resume_all(self):
+        """Продолжает рассылки, прерванные перезапуском бота"""
+        for broadcast in self.db.get_unfinished_broadcasts():
+            logging.info(f"Resuming broadcast {broadcast['id']} after user {broadcast['last_user_id']}")
+            self._spawn(broadcast)
+
+    def stop(self, timeout=None):
+        """Останавливает рассылки, сохраняя курсор для продолжения"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _spawn(self, broadcast):
+        thread = threading.Thread(target=self._run, args=(broadcast,),
+                                  name=f"broadcast-{broadcast['id']}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _run(self, broadcast):
+        try:
+            self._broadcast(broadcast)
+        finally:
+            # Поток рассылки завершается — его соединение с базой больше не нужно
+            self.db.release_connection()
+
+    def _broadcast(self, broadcast):
+        state = dict(broadcast)
+        last_progress = 0
+
+        with ThreadPoolExecutor(max_workers=self.senders,
+                                thread_name_prefix=f"broadcast-{broadcast['id']}") as pool:
+            chunk = []
+            for user_id in self.db.iter_user_ids(active_only=True, after_id=state['last_user_id']):
+                chunk.append(user_id)
+                if len(chunk) < self.chunk_size:
+                    continue
+
+                self._send_chunk(pool, state, chunk)
+                chunk = []
+                if self._stopping.is_set():
+                    logging.info(f"Broadcast {state['id']} paused at user {state['last_user_id']}")
+                    return
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    self._report(state, finished=False)
+
+            if chunk:
+                self._send_chunk(pool, state, chunk)
+
+        self.db.update_broadcast(state['id'], state['last_user_id'], state['sent'],
+                                 state['failed'], state['blocked'], status='done')
+        self._report(state, finished=True)
+        logging.info(f"Broadcast {state['id']} finished: sent={state['sent']} "
+                     f"failed={state['failed']} blocked={state['blocked']}")
+
+    def _send_chunk(self, pool, state, chunk):
+        # В базу пишет только поток рассылки: потоки пула не открывают своих соединений
+        results = pool.map(lambda user_id: self._send(user_id, state['text']), chunk)
+        for user_id, result in zip(chunk, results):
+            state[result] += 1
+            if result == 'blocked':
+                # Пользователь заблокировал бота — исключаем из следующих рассылок
+                self.db.set_user_active(user_id, False)
+        state['last_user_id'] = chunk[-1]
+        self.db.update_broadcast(state['id'], state['last_user_id'], state['sent'],
+                                 state['failed'], state['blocked'])
+
+    def _send(self, user_id, text):
+        """Отправляет одно сообщение; возвращает 'sent', 'failed' или 'blocked'"""
+        for _ in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(user_id, text, parse_mode='markdown')
+                return 'sent'
+
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    # Притормаживаем всех отправителей на время, указанное Telegram
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    logging.warning(f"Broadcast rate limited, retry after {retry_after}s")
+                    self.bucket.pause(retry_after)
+                    continue
+                if e.error_code == 403:
+                    return 'blocked'
+                logging.warning(f"Failed to send message to {user_id}: {e}")
+                return 'failed'
+
+            except Exception as e:
+                logging.warning(f"Failed to send message to {user_id}: {e}")
+                return 'failed'
+
+        return 'failed'
+
+    def _report(self, state, finished):
+        processed = state['sent'] + state['failed'] + state['blocked']
+        title = '*Рассылка завершена:*' if finished else f"🔊 *Рассылка:* {processed} из {state['total']}"
+        text = (f"{title}\n✅ Доставлено: {state['sent']}\n❌ Не доставлено: {state['failed']}\n"
+                f"🚫 Заблокировали бота: {state['blocked']}")
+        markup = keyboards.admin_menu() if finished else None
+
+        try:
+            if state['progress_message_id']:
+                self.bot.edit_message_text(text, state['admin_id'], state['progress_message_id'],
+                                           parse_mode='markdown', reply_markup=markup)
+            elif finished:
+                self.bot.send_message(state['admin_id'], text, parse_mode='markdown', reply_markup=markup)
+        except Exception as e:
+            logging.warning(f"Failed to report broadcast {state['id']} progress: {e}")
@@ -1,8 +1,115 @@
-import json
-
-settings = json.load(open('settings.json', 'r'))
-
-channel_id = settings['channel_id']
-channel_url = settings['channel_url']
-admin_ids = settings['admin_ids']
-token = settings['token']
\ No newline at end of file
+import json
+from pathlib import Path
+
+settings = json.load(open('settings.json', 'r'))
+
+channel_id = settings['channel_id']
+channel_url = settings['channel_url']
+admin_ids = settings['admin_ids']
+token = settings['token']
+
+# Кэш проверки подписок: время жизни положительного и отрицательного результата (сек)
+subscription_cache_ttl = settings.get('subscription_cache_ttl', 300)
+subscription_cache_negative_ttl = settings.get('subscription_cache_negative_ttl', 30)
+subscription_cache_size = settings.get('subscription_cache_size', 50000)
+
+# Параллельная проверка подписок: размер пула и дедлайн ожидания ответа API (сек)
+subscription_check_workers = settings.get('subscription_check_workers', 16)
+subscription_check_timeout = settings.get('subscription_check_timeout', 5)
+
+# Очередь загрузок: ёмкость и размеры пулов воркеров скачивания и отправки
+download_queue_size = settings.get('download_queue_size', 100)
+download_workers = settings.get('download_workers', 2)
+upload_workers = settings.get('upload_workers', 2)
+
+# Несколько ссылок в одном сообщении: сколько ссылок принимается и сколько из них
+# одновременно стоит в очереди загрузок
+max_links_per_message = settings.get('max_links_per_message', 10)
+batch_parallelism = settings.get('batch_parallelism', 2)
+
+# Кэш метаданных видео (info-словарей yt-dlp)
+info_cache_ttl = settings.get('info_cache_ttl', 300)
+info_cache_size = settings.get('info_cache_size', 1000)
+
+# Скачивание: сколько фрагментов (DASH/HLS) одной задачи качается одновременно, качать ли
+# видео и аудио параллельно (склейка через ffmpeg) и внешний загрузчик, например 'aria2c'
+# ('' — встроенный загрузчик yt-dlp) с лимитом соединений на одну задачу
+concurrent_fragment_downloads = settings.get('concurrent_fragment_downloads', 4)
+parallel_streams = settings.get('parallel_streams', True)
+external_downloader = settings.get('external_downloader', '')
+external_downloader_connections = settings.get('external_downloader_connections', 8)
+
+# Адрес сервера Bot API (пусто — api.telegram.org), например http://127.0.0.1:8081.
+# local_bot_api: локальный сервер читает файлы по пути file:// с общего диска.
+# Без bot_api_url запросы идут на api.telegram.org, поэтому локальный режим не включается
+bot_api_url = settings.get('bot_api_url', '')
+local_bot_api = bool(settings.get('local_bot_api', False) and bot_api_url)
+# local_bot_api_downloads_dir: абсолютный путь к downloads/ так, как его видит сервер
+local_bot_api_downloads_dir = settings.get('local_bot_api_downloads_dir', '')
+if local_bot_api_downloads_dir and not Path(local_bot_api_downloads_dir).is_absolute():
+    raise ValueError(f"local_bot_api_downloads_dir must be an absolute path, got {local_bot_api_downloads_dir!r}")
+
+# Лимит размера отправляемого видео (байт): 50 МБ у api.telegram.org, 2000 МБ у локального сервера
+max_file_size = settings.get('max_file_size', (2000 if local_bot_api else 50) * 1024 * 1024)
+
+# Рассылка: общий лимит сообщений в секунду, число отправителей и период обновления прогресса (сек)
+broadcast_rate = settings.get('broadcast_rate', 25)
+broadcast_senders = settings.get('broadcast_senders', 8)
+broadcast_progress_interval = settings.get('broadcast_progress_interval', 5)
+
+# Экспорт пользователей: формат ('json' или 'ndjson') и сжатие gzip
+export_format = settings.get('export_format', 'json')
+export_compress = settings.get('export_compress', True)
+
+# Экспорт базы: 'sql' — дамп, 'db' — файл снимка SQLite
+sql_export_mode = settings.get('sql_export_mode', 'sql')
+
+# Асинхронный режим (async_bot.py): пул соединений aiohttp и размеры пулов потоков
+async_connection_limit = settings.get('async_connection_limit', 100)
+async_executor_workers = settings.get('async_executor_workers', 16)
+
+# Режим webhook: вместо long polling обновления принимает встроенный HTTP-сервер
+webhook_enabled = settings.get('webhook_enabled', False)
+webhook_url = settings.get('webhook_url', '')
+webhook_host = settings.get('webhook_host', '0.0.0.0')
+webhook_port = settings.get('webhook_port', 8443)
+webhook_path = settings.get('webhook_path', '/webhook')
+webhook_secret = settings.get('webhook_secret', '')
+webhook_queue_size = settings.get('webhook_queue_size', 1000)
+webhook_workers = settings.get('webhook_workers', 8)
+
+# Кэш скачанных файлов в downloads/: лимит размера, время жизни (сек) и минимум свободного места
+download_cache_max_bytes = settings.get('download_cache_max_bytes', 5 * 1024 ** 3)
+download_cache_ttl = settings.get('download_cache_ttl', 3600)
+download_min_free_bytes = settings.get('download_min_free_bytes', 1024 ** 3)
+
+# Прогресс загрузки: не чаще одной правки сообщения за progress_update_interval сек на чат
+# и не больше progress_edit_rate правок в секунду на весь бот
+progress_update_interval = settings.get('progress_update_interval', 3)
+progress_edit_rate = settings.get('progress_edit_rate', 20)
+
+# Контроль допуска загрузок по тарифам: одновременные загрузки пользователя и частота запросов
+# (per_minute в минуту, не больше burst подряд); общий потолок одновременных загрузок (без учёта админов)
+admission_tiers = settings.get('admission_tiers', {
+    'default': {'concurrent': 1, 'per_minute': 4, 'burst': 3},
+    'premium': {'concurrent': 3, 'per_minute': 12, 'burst': 6},
+    'admin': {'concurrent': 10, 'per_minute': 120, 'burst': 30},
+})
+max_concurrent_downloads = settings.get('max_concurrent_downloads', 50)
+
+# Метрики: эндпоинт Prometheus /metrics (только локальный по умолчанию)
+# и период сохранения перцентилей этапов в базу (сек)
+metrics_enabled = settings.get('metrics_enabled', False)
+metrics_host = settings.get('metrics_host', '127.0.0.1')
+metrics_port = settings.get('metrics_port', 9108)
+metrics_snapshot_interval = settings.get('metrics_snapshot_interval', 300)
+
+# Логирование: уровень, файл с ротацией по размеру (или по времени, например 'midnight'),
+# JSON-формат и лимит строк в секунду для подробностей проверки подписок (уровень DEBUG)
+log_level = settings.get('log_level', 'INFO')
+log_file = settings.get('log_file', 'bot.log')
+log_max_bytes = settings.get('log_max_bytes', 10 * 1024 * 1024)
+log_backup_count = settings.get('log_backup_count', 5)
+log_rotate_when = settings.get('log_rotate_when', '')
+log_json = settings.get('log_json', False)
+log_sample_rate = settings.get('log_sample_rate', 10)
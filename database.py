@@ -1,337 +1,1107 @@
-import sqlite3
-import json
-import os
-from datetime import datetime
-from typing import List, Dict, Optional
-
-class DatabaseManager:
-    def __init__(self, db_path='bot_database.db'):
-        self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Создаем таблицу пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                language_code TEXT,
-                is_bot INTEGER DEFAULT 0,
-                is_premium INTEGER DEFAULT 0,
-                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                total_downloads INTEGER DEFAULT 0,
-                is_active INTEGER DEFAULT 1
-            )
-        ''')
-        
-        # Создаем таблицу загрузок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS downloads (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                video_url TEXT,
-                video_title TEXT,
-                download_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                file_size INTEGER,
-                success INTEGER DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Создаем индексы для быстрого поиска
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON downloads (user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_time ON downloads (download_time)')
-        
-        conn.commit()
-        conn.close()
-    
-    def save_user(self, user_data: Dict) -> bool:
-        """Сохраняет или обновляет информацию о пользователе"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Проверяем существует ли пользователь
-            cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_data['user_id'],))
-            exists = cursor.fetchone()
-            
-            current_time = datetime.now().isoformat()
-            
-            if exists:
-                # Обновляем существующего пользователя
-                cursor.execute('''
-                    UPDATE users SET 
-                        username = ?, first_name = ?, last_name = ?, 
-                        language_code = ?, is_bot = ?, is_premium = ?,
-                        last_interaction = ?
-                    WHERE user_id = ?
-                ''', (
-                    user_data.get('username'),
-                    user_data.get('first_name'),
-                    user_data.get('last_name'),
-                    user_data.get('language_code'),
-                    user_data.get('is_bot', 0),
-                    user_data.get('is_premium', 0),
-                    current_time,
-                    user_data['user_id']
-                ))
-            else:
-                # Добавляем нового пользователя
-                cursor.execute('''
-                    INSERT INTO users (
-                        user_id, username, first_name, last_name, 
-                        language_code, is_bot, is_premium, 
-                        first_interaction, last_interaction
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    user_data['user_id'],
-                    user_data.get('username'),
-                    user_data.get('first_name'),
-                    user_data.get('last_name'),
-                    user_data.get('language_code'),
-                    user_data.get('is_bot', 0),
-                    user_data.get('is_premium', 0),
-                    current_time,
-                    current_time
-                ))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            print(f"Error saving user: {e}")
-            return False
-    
-    def add_download(self, user_id: int, video_url: str, video_title: str = None, 
-                    file_size: int = None, success: bool = True) -> bool:
-        """Добавляет запись о загрузке"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Добавляем запись о загрузке
-            cursor.execute('''
-                INSERT INTO downloads (user_id, video_url, video_title, file_size, success)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, video_url, video_title, file_size, 1 if success else 0))
-            
-            # Обновляем счетчик загрузок пользователя
-            cursor.execute('''
-                UPDATE users SET 
-                    total_downloads = total_downloads + 1,
-                    last_interaction = ?
-                WHERE user_id = ?
-            ''', (datetime.now().isoformat(), user_id))
-            
-            conn.commit()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            print(f"Error adding download: {e}")
-            return False
-    
-    def get_user_info(self, user_id: int) -> Optional[Dict]:
-        """Получает полную информацию о пользователе"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Получаем информацию о пользователе
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            user_row = cursor.fetchone()
-            
-            if not user_row:
-                return None
-            
-            # Получаем загрузки пользователя
-            cursor.execute('''
-                SELECT video_url, video_title, download_time, file_size, success 
-                FROM downloads WHERE user_id = ? 
-                ORDER BY download_time DESC
-            ''', (user_id,))
-            downloads = cursor.fetchall()
-            
-            conn.close()
-            
-            # Формируем результат
-            columns = [description[0] for description in cursor.description if description[0] != 'user_id']
-            user_info = dict(zip(['user_id'] + columns[:-1], user_row))
-            
-            user_info['downloads'] = [
-                {
-                    'video_url': d[0],
-                    'video_title': d[1],
-                    'download_time': d[2],
-                    'file_size': d[3],
-                    'success': bool(d[4])
-                }
-                for d in downloads
-            ]
-            
-            return user_info
-            
-        except Exception as e:
-            print(f"Error getting user info: {e}")
-            return None
-    
-    def get_all_users(self) -> List[Dict]:
-        """Получает информацию о всех пользователях"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM users ORDER BY first_interaction DESC')
-            users = cursor.fetchall()
-            
-            result = []
-            for user_row in users:
-                user_id = user_row[0]
-                
-                # Получаем загрузки для каждого пользователя
-                cursor.execute('''
-                    SELECT video_url, video_title, download_time, file_size, success 
-                    FROM downloads WHERE user_id = ? 
-                    ORDER BY download_time DESC
-                ''', (user_id,))
-                downloads = cursor.fetchall()
-                
-                # Формируем информацию о пользователе
-                user_info = {
-                    'user_id': user_row[0],
-                    'username': user_row[1],
-                    'first_name': user_row[2],
-                    'last_name': user_row[3],
-                    'language_code': user_row[4],
-                    'is_bot': bool(user_row[5]),
-                    'is_premium': bool(user_row[6]),
-                    'first_interaction': user_row[7],
-                    'last_interaction': user_row[8],
-                    'total_downloads': user_row[9],
-                    'is_active': bool(user_row[10]),
-                    'downloads': [
-                        {
-                            'video_url': d[0],
-                            'video_title': d[1],
-                            'download_time': d[2],
-                            'file_size': d[3],
-                            'success': bool(d[4])
-                        }
-                        for d in downloads
-                    ]
-                }
-                result.append(user_info)
-            
-            conn.close()
-            return result
-            
-        except Exception as e:
-            print(f"Error getting all users: {e}")
-            return []
-    
-    def export_to_json(self, filepath: str = None) -> str:
-        """Экспортирует всех пользователей в JSON"""
-        if not filepath:
-            filepath = f'users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-        
-        users_data = self.get_all_users()
-        
-        export_data = {
-            'export_time': datetime.now().isoformat(),
-            'total_users': len(users_data),
-            'users': users_data
-        }
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(export_data, f, ensure_ascii=False, indent=2)
-        
-        return filepath
-    
-    def export_to_sql(self, filepath: str = None) -> str:
-        """Экспортирует базу данных в SQL файл"""
-        if not filepath:
-            filepath = f'database_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.sql'
-        
-        try:
-            conn = sqlite3.connect(self.db_path)
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                # Добавляем заголовок
-                f.write(f"-- Database export created at {datetime.now().isoformat()}\n")
-                f.write("-- Bot Database Export\n\n")
-                
-                # Экспортируем схему и данные
-                for line in conn.iterdump():
-                    f.write(f"{line}\n")
-            
-            conn.close()
-            return filepath
-            
-        except Exception as e:
-            print(f"Error exporting to SQL: {e}")
-            return None
-    
-    def get_statistics(self) -> Dict:
-        """Получает статистику по базе данных"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Общая статистика пользователей
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
-            active_users = cursor.fetchone()[0]
-            
-            # Статистика загрузок
-            cursor.execute('SELECT COUNT(*) FROM downloads')
-            total_downloads = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM downloads WHERE success = 1')
-            successful_downloads = cursor.fetchone()[0]
-            
-            # Топ пользователей по загрузкам
-            cursor.execute('''
-                SELECT u.user_id, u.username, u.first_name, COUNT(d.id) as download_count
-                FROM users u
-                LEFT JOIN downloads d ON u.user_id = d.user_id
-                GROUP BY u.user_id
-                ORDER BY download_count DESC
-                LIMIT 10
-            ''')
-            top_users = cursor.fetchall()
-            
-            conn.close()
-            
-            return {
-                'total_users': total_users,
-                'active_users': active_users,
-                'total_downloads': total_downloads,
-                'successful_downloads': successful_downloads,
-                'success_rate': (successful_downloads / total_downloads * 100) if total_downloads > 0 else 0,
-                'top_users': [
-                    {
-                        'user_id': row[0],
-                        'username': row[1],
-                        'first_name': row[2],
-                        'download_count': row[3]
-                    }
-                    for row in top_users
-                ]
-            }
-            
-        except Exception as e:
-            print(f"Error getting statistics: {e}")
-            return {}
-
-# Создаем глобальный экземпляр менеджера базы данных
+import sqlite3
+import json
+import os
+import gzip
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import List, Dict, Optional, Iterator
+import metrics
+
+# Сколько ждать освобождения блокировки другим потоком (сек)
+BUSY_TIMEOUT = 10
+# Размер кэша подготовленных выражений на соединение
+CACHED_STATEMENTS = 256
+# Отложенная запись: интервал сброса (сек) и размер буфера, при котором сброс идёт сразу.
+# При аварийном завершении теряется не больше одного такого окна.
+FLUSH_INTERVAL = 0.5
+FLUSH_MAX_RECORDS = 500
+# Потолок буфера, если база недоступна и сброс не удаётся: старые записи сверх него отбрасываются
+MAX_PENDING_RECORDS = 50000
+# Максимальный размер части экспорта: Telegram принимает документы до 50 МБ
+EXPORT_PART_SIZE = 45 * 1024 * 1024
+
+# Колонки users в порядке, который ожидает _user_from_row
+USER_COLUMNS = (
+    'user_id, username, first_name, last_name, language_code, is_bot, is_premium, '
+    'first_interaction, last_interaction, total_downloads, is_active'
+)
+USER_COLUMNS_U = ', '.join(f'u.{c.strip()}' for c in USER_COLUMNS.split(','))
+# Начальное значение курсора постраничной выборки
+MIN_USER_ID = -(2 ** 63)
+
+# Длина префикса времени 'YYYY-MM-DD HH:MM:SS' для каждого периода агрегатов
+ROLLUP_PERIODS = {'hour': 13, 'day': 10}
+
+def _utc_now() -> str:
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+def _group_by_hour(downloads: List[tuple]):
+    """Группирует записи буфера загрузок по часу: (время, всего, успешных)"""
+    groups = {}
+    for d in downloads:
+        if d[8]:
+            continue
+        hour = d[3][:13]
+        count, ok, _ = groups.get(hour, (0, 0, d[3]))
+        groups[hour] = (count + 1, ok + d[5], d[3])
+    return [(timestamp, count, ok) for count, ok, timestamp in groups.values()]
+
+def _user_from_row(row) -> Dict:
+    return {
+        'user_id': row[0],
+        'username': row[1],
+        'first_name': row[2],
+        'last_name': row[3],
+        'language_code': row[4],
+        'is_bot': bool(row[5]),
+        'is_premium': bool(row[6]),
+        'first_interaction': row[7],
+        'last_interaction': row[8],
+        'total_downloads': row[9],
+        'is_active': bool(row[10])
+    }
+
+class _ExportWriter:
+    """Пишет пользователей в JSON/NDJSON, разбивая вывод на части не больше max_part_size"""
+    
+    def __init__(self, base_path: str, fmt: str = 'json', compress: bool = False,
+                 max_part_size: int = None, since: str = None):
+        if fmt not in ('json', 'ndjson'):
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.base_path = base_path
+        self.fmt = fmt
+        self.compress = compress
+        self.max_part_size = max_part_size
+        self.since = since
+        self.parts = []
+        self._raw = None
+        self._stream = None
+        self._count = 0
+        
+        # Без разбиения base_path — это итоговое имя файла
+        if max_part_size is None:
+            self._open(base_path)
+    
+    def _open(self, path: str = None):
+        if path is None:
+            suffix = '.ndjson' if self.fmt == 'ndjson' else '.json'
+            if self.compress:
+                suffix += '.gz'
+            path = f'{self.base_path}_part{len(self.parts) + 1}{suffix}'
+        
+        self._raw = open(path, 'wb')
+        self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb') if self.compress else self._raw
+        self._count = 0
+        self.parts.append(path)
+        
+        if self.fmt == 'json':
+            header = {'export_time': datetime.now().isoformat(), 'part': len(self.parts)}
+            if self.since:
+                header['since'] = self.since
+            # Открываем объект и массив users вручную, чтобы писать пользователей по одному
+            self._write(json.dumps(header, ensure_ascii=False)[:-1] + ', "users": [\n')
+    
+    def _write(self, text: str):
+        self._stream.write(text.encode('utf-8'))
+    
+    def _close_part(self):
+        if self._raw is None:
+            return
+        if self.fmt == 'json':
+            self._write(f'\n], "total_users": {self._count}}}\n')
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+        self._raw = self._stream = None
+    
+    def write(self, user: Dict):
+        data = json.dumps(user, ensure_ascii=False)
+        
+        # Размер считаем по уже записанным на диск байтам (для gzip — сжатым)
+        if self._raw is not None and self.max_part_size and self._count \
+                and self._raw.tell() + len(data) > self.max_part_size:
+            self._close_part()
+        if self._raw is None:
+            self._open()
+        
+        if self.fmt == 'json':
+            self._write((',\n' if self._count else '') + data)
+        else:
+            self._write(data + '\n')
+        self._count += 1
+    
+    def close(self):
+        # Пустой экспорт всё равно даёт один корректный файл
+        if not self.parts:
+            self._open()
+        self._close_part()
+
+class DatabaseManager:
+    def __init__(self, db_path='bot_database.db', flush_interval=FLUSH_INTERVAL,
+                 flush_max_records=FLUSH_MAX_RECORDS, max_pending_records=MAX_PENDING_RECORDS):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_max_records = flush_max_records
+        self.max_pending_records = max_pending_records
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        
+        # Буфер отложенной записи активности пользователей и загрузок
+        self._pending_users = {}
+        self._pending_downloads = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closing = threading.Event()
+        
+        self.init_database()
+        
+        self._flusher = threading.Thread(target=self._flush_loop, name='db-flush', daemon=True)
+        self._flusher.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает постоянное соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=BUSY_TIMEOUT,
+                cached_statements=CACHED_STATEMENTS,
+                check_same_thread=False  # закрываются из close() в основном потоке
+            )
+            # WAL: читатели не блокируют писателя; NORMAL достаточно надёжен в режиме WAL
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    def release_connection(self):
+        """Закрывает соединение текущего потока; вызывается потоками, которые скоро завершатся"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+    
+    def _rollback(self):
+        """Откатывает незавершённую транзакцию после ошибки"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+    
+    def close(self):
+        """Сбрасывает буфер и закрывает все соединения (вызывается при остановке бота)"""
+        self._closing.set()
+        self._flush_event.set()
+        self._flusher.join(timeout=BUSY_TIMEOUT)
+        self.flush()
+        
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+    
+    def init_database(self):
+        """Инициализация базы данных"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        # Создаем таблицу пользователей
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                language_code TEXT,
+                is_bot INTEGER DEFAULT 0,
+                is_premium INTEGER DEFAULT 0,
+                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                total_downloads INTEGER DEFAULT 0,
+                is_active INTEGER DEFAULT 1
+            )
+        ''')
+        
+        # Создаем таблицу загрузок
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS downloads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                video_url TEXT,
+                video_title TEXT,
+                download_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                file_size INTEGER,
+                success INTEGER DEFAULT 1,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        
+        # Миграция: оценка размера выбранного формата
+        cursor.execute('PRAGMA table_info(downloads)')
+        if 'estimated_size' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE downloads ADD COLUMN estimated_size INTEGER')
+        
+        # Миграция: причина отказа контроля допуска (NULL — запрос принят)
+        cursor.execute('PRAGMA table_info(downloads)')
+        if 'reject_reason' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE downloads ADD COLUMN reject_reason TEXT')
+        
+        # Миграция: ID видео YouTube — единый ключ вместо исходной ссылки
+        cursor.execute('PRAGMA table_info(downloads)')
+        if 'video_id' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE downloads ADD COLUMN video_id TEXT')
+        
+        # Создаем таблицу file_id уже отправленных видео
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS video_files (
+                video_id TEXT NOT NULL,
+                format_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_size INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (video_id, format_id)
+            )
+        ''')
+        
+        # Миграция: лимит размера, под который выбирался формат, и название видео —
+        # повторный запрос обслуживается по file_id без извлечения метаданных
+        cursor.execute('PRAGMA table_info(video_files)')
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'max_bytes' not in columns:
+            cursor.execute('ALTER TABLE video_files ADD COLUMN max_bytes INTEGER')
+        if 'title' not in columns:
+            cursor.execute('ALTER TABLE video_files ADD COLUMN title TEXT')
+        
+        # Создаем таблицу рассылок (курсор позволяет продолжить после перезапуска)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id INTEGER,
+                text TEXT,
+                status TEXT DEFAULT 'running',
+                last_user_id INTEGER,
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                progress_message_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        ''')
+        
+        # Создаем индексы для быстрого поиска
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON downloads (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_time ON downloads (download_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_downloads_video_id ON downloads (video_id)')
+        # Индекс для топа пользователей без сканирования downloads
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_total_downloads ON users (total_downloads DESC)')
+        
+        # Счётчики статистики, обновляемые в тех же транзакциях, что и данные
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # Почасовые и посуточные агрегаты (время в UTC)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_rollups (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                new_users INTEGER DEFAULT 0,
+                downloads INTEGER DEFAULT 0,
+                successful_downloads INTEGER DEFAULT 0,
+                PRIMARY KEY (period, bucket)
+            )
+        ''')
+        
+        # Перцентили длительности этапов обработки за интервалы (время в UTC)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stage_latency (
+                recorded_at TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                samples INTEGER,
+                p50 REAL,
+                p90 REAL,
+                p99 REAL,
+                max REAL,
+                PRIMARY KEY (recorded_at, stage)
+            )
+        ''')
+        
+        # Первый запуск со счётчиками: однократно заполняем их по существующим данным
+        cursor.execute('SELECT COUNT(*) FROM stats_counters')
+        if cursor.fetchone()[0] == 0:
+            self._backfill_statistics(cursor)
+        
+        conn.commit()
+    
+    def _backfill_statistics(self, cursor):
+        cursor.execute('''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'total_users', COUNT(*) FROM users
+            UNION ALL SELECT 'active_users', COUNT(*) FROM users WHERE is_active = 1
+            UNION ALL SELECT 'total_downloads', COUNT(*) FROM downloads WHERE reject_reason IS NULL
+            UNION ALL SELECT 'successful_downloads', COUNT(*) FROM downloads WHERE success = 1
+            UNION ALL SELECT 'rejected_downloads', COUNT(*) FROM downloads WHERE reject_reason IS NOT NULL
+            UNION ALL SELECT 'rejected_downloads:' || reject_reason, COUNT(*) FROM downloads 
+                      WHERE reject_reason IS NOT NULL GROUP BY reject_reason
+        ''')
+        
+        # download_time хранится в UTC, first_interaction — в локальном времени сервера:
+        # приводим его к UTC, как и живые инкременты (_utc_now)
+        for period, length in ROLLUP_PERIODS.items():
+            cursor.execute(f'''
+                INSERT INTO stats_rollups (period, bucket, downloads, successful_downloads)
+                SELECT ?, substr(download_time, 1, {length}), COUNT(*), SUM(success)
+                FROM downloads WHERE reject_reason IS NULL GROUP BY 2
+            ''', (period,))
+            cursor.execute(f'''
+                INSERT INTO stats_rollups (period, bucket, new_users)
+                SELECT ?, substr(datetime(first_interaction, 'utc'), 1, {length}), COUNT(*)
+                FROM users WHERE 1 GROUP BY 2  -- WHERE нужен парсеру для INSERT ... SELECT ... ON CONFLICT
+                ON CONFLICT (period, bucket) DO UPDATE SET new_users = excluded.new_users
+            ''', (period,))
+    
+    def _bump_counters(self, conn, deltas: Dict[str, int]):
+        conn.executemany('''
+            INSERT INTO stats_counters (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+        ''', [(name, delta) for name, delta in deltas.items() if delta])
+    
+    def _bump_rollups(self, conn, timestamp: str, new_users: int = 0, 
+                      downloads: int = 0, successful: int = 0):
+        conn.executemany('''
+            INSERT INTO stats_rollups (period, bucket, new_users, downloads, successful_downloads)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (period, bucket) DO UPDATE SET 
+                new_users = new_users + excluded.new_users,
+                downloads = downloads + excluded.downloads,
+                successful_downloads = successful_downloads + excluded.successful_downloads
+        ''', [
+            (period, timestamp[:length], new_users, downloads, successful)
+            for period, length in ROLLUP_PERIODS.items()
+        ])
+    
+    def save_user(self, user_data: Dict) -> bool:
+        """Сохраняет или обновляет информацию о пользователе.
+        
+        Запись попадает в буфер и сохраняется фоновым потоком вместе с другими;
+        повторные сообщения одного пользователя в пределах окна объединяются.
+        """
+        current_time = datetime.now().isoformat()
+        
+        with self._buffer_lock:
+            pending = self._pending_users.get(user_data['user_id'])
+            first_interaction = pending['first_interaction'] if pending else current_time
+            self._pending_users[user_data['user_id']] = {
+                **user_data,
+                'first_interaction': first_interaction,
+                'last_interaction': current_time
+            }
+            size = len(self._pending_users) + len(self._pending_downloads)
+        
+        if size >= self.flush_max_records:
+            self._flush_event.set()
+        return True
+    
+    def add_download(self, user_id: int, video_url: str, video_title: str = None, 
+                    file_size: int = None, success: bool = True, estimated_size: int = None,
+                    reject_reason: str = None, video_id: str = None) -> bool:
+        """Добавляет запись о загрузке (через буфер отложенной записи).
+        
+        Запросы, отклонённые контролем допуска, пишутся с reject_reason и не
+        учитываются в счётчиках загрузок — только в rejected_downloads.
+        """
+        with self._buffer_lock:
+            self._pending_downloads.append((
+                user_id, video_url, video_title,
+                _utc_now(),
+                file_size, 0 if reject_reason or not success else 1, estimated_size,
+                datetime.now().isoformat(), reject_reason, video_id
+            ))
+            size = len(self._pending_users) + len(self._pending_downloads)
+        
+        if size >= self.flush_max_records:
+            self._flush_event.set()
+        return True
+    
+    def flush(self) -> bool:
+        """Записывает накопленные изменения одной транзакцией"""
+        with self._flush_lock:
+            with self._buffer_lock:
+                users, self._pending_users = self._pending_users, {}
+                downloads, self._pending_downloads = self._pending_downloads, []
+            
+            if not users and not downloads:
+                return True
+            
+            try:
+                started = time.monotonic()
+                conn = self._connect()
+                with conn:
+                    self._write_users(conn, list(users.values()))
+                    self._write_downloads(conn, downloads)
+                metrics.observe('db_write', time.monotonic() - started)
+                return True
+                
+            except Exception as e:
+                print(f"Error flushing write buffer: {e}")
+                self._rollback()
+                # Возвращаем записи в буфер, более новые данные пользователя не затираем
+                with self._buffer_lock:
+                    for user_id, data in users.items():
+                        self._pending_users.setdefault(user_id, data)
+                    self._pending_downloads[:0] = downloads
+                    dropped = self._trim_buffer()
+                if dropped:
+                    print(f"Write buffer is full, dropped {dropped} oldest pending records")
+                return False
+    
+    def _trim_buffer(self) -> int:
+        """Ограничивает буфер max_pending_records записями (под _buffer_lock).
+        
+        Сначала отбрасываются самые старые загрузки, затем самые старые пользователи.
+        """
+        overflow = len(self._pending_users) + len(self._pending_downloads) - self.max_pending_records
+        if overflow <= 0:
+            return 0
+        downloads = min(overflow, len(self._pending_downloads))
+        del self._pending_downloads[:downloads]
+        for user_id in list(self._pending_users)[:overflow - downloads]:
+            del self._pending_users[user_id]
+        return overflow
+    
+    def _write_users(self, conn, users: List[Dict]):
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO users (
+                user_id, username, first_name, last_name, 
+                language_code, is_bot, is_premium, 
+                first_interaction, last_interaction
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
+                u['user_id'], u.get('username'), u.get('first_name'), u.get('last_name'),
+                u.get('language_code'), u.get('is_bot', 0), u.get('is_premium', 0),
+                u['first_interaction'], u['last_interaction']
+            )
+            for u in users
+        ])
+        
+        # Новые пользователи — те, кого INSERT OR IGNORE действительно вставил
+        inserted = max(cursor.rowcount, 0)
+        if inserted:
+            self._bump_counters(conn, {'total_users': inserted, 'active_users': inserted})
+            self._bump_rollups(conn, _utc_now(), new_users=inserted)
+
+        # Пользователь, заблокировавший бота (403 при рассылке), снова пишет — значит, разблокировал
+        cursor = conn.executemany(
+            'UPDATE users SET is_active = 1 WHERE user_id = ? AND is_active = 0',
+            [(u['user_id'],) for u in users]
+        )
+        reactivated = max(cursor.rowcount, 0)
+        if reactivated:
+            self._bump_counters(conn, {'active_users': reactivated})
+
+        conn.executemany('''
+            UPDATE users SET 
+                username = ?, first_name = ?, last_name = ?, 
+                language_code = ?, is_bot = ?, is_premium = ?,
+                last_interaction = ?
+            WHERE user_id = ?
+        ''', [
+            (
+                u.get('username'), u.get('first_name'), u.get('last_name'),
+                u.get('language_code'), u.get('is_bot', 0), u.get('is_premium', 0),
+                u['last_interaction'], u['user_id']
+            )
+            for u in users
+        ])
+    
+    def _write_downloads(self, conn, downloads: List[tuple]):
+        conn.executemany('''
+            INSERT INTO downloads (user_id, video_url, video_title, download_time, 
+                                   file_size, success, estimated_size, reject_reason, video_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [d[:7] + d[8:10] for d in downloads])
+        
+        rejected = {}
+        for d in downloads:
+            if d[8]:
+                rejected[f'rejected_downloads:{d[8]}'] = rejected.get(f'rejected_downloads:{d[8]}', 0) + 1
+        accepted = len(downloads) - sum(rejected.values())
+        
+        successful = sum(d[5] for d in downloads)
+        self._bump_counters(conn, {'total_downloads': accepted, 'successful_downloads': successful,
+                                   'rejected_downloads': len(downloads) - accepted, **rejected})
+        for timestamp, count, ok in _group_by_hour(downloads):
+            self._bump_rollups(conn, timestamp, downloads=count, successful=ok)
+        
+        # Обновляем счетчики загрузок пользователей одним запросом на пользователя
+        totals = {}
+        for d in downloads:
+            count, _ = totals.get(d[0], (0, None))
+            totals[d[0]] = (count + (0 if d[8] else 1), d[7])
+        
+        conn.executemany('''
+            UPDATE users SET 
+                total_downloads = total_downloads + ?,
+                last_interaction = ?
+            WHERE user_id = ?
+        ''', [(count, last, user_id) for user_id, (count, last) in totals.items()])
+    
+    def _flush_loop(self):
+        while not self._closing.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            self.flush()
+    
+    def set_user_active(self, user_id: int, is_active: bool) -> bool:
+        """Помечает пользователя активным/неактивным (например, если он заблокировал бота)"""
+        self.flush()
+        try:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    'UPDATE users SET is_active = ? WHERE user_id = ? AND is_active != ?',
+                    (1 if is_active else 0, user_id, 1 if is_active else 0)
+                )
+                if cursor.rowcount:
+                    self._bump_counters(conn, {'active_users': 1 if is_active else -1})
+            return True
+            
+        except Exception as e:
+            print(f"Error updating user activity: {e}")
+            self._rollback()
+            return False
+    
+    def count_users(self, active_only: bool = False) -> int:
+        """Возвращает количество пользователей"""
+        counters = self.get_counters()
+        return counters.get('active_users' if active_only else 'total_users', 0)
+    
+    def get_counters(self) -> Dict[str, int]:
+        """Возвращает счётчики статистики"""
+        self.flush()
+        try:
+            conn = self._connect()
+            return dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+            
+        except Exception as e:
+            print(f"Error getting counters: {e}")
+            return {}
+    
+    def get_trends(self, period: str = 'day', limit: int = 7) -> List[Dict]:
+        """Возвращает последние агрегаты за час/сутки (от новых к старым)"""
+        self.flush()
+        try:
+            conn = self._connect()
+            rows = conn.execute('''
+                SELECT bucket, new_users, downloads, successful_downloads 
+                FROM stats_rollups WHERE period = ? 
+                ORDER BY bucket DESC LIMIT ?
+            ''', (period, limit)).fetchall()
+            return [
+                {
+                    'bucket': row[0],
+                    'new_users': row[1],
+                    'downloads': row[2],
+                    'successful_downloads': row[3]
+                }
+                for row in rows
+            ]
+            
+        except Exception as e:
+            print(f"Error getting trends: {e}")
+            return []
+    
+    def save_stage_latency(self, rows: List[tuple]) -> bool:
+        """Сохраняет перцентили этапов: строки (stage, samples, p50, p90, p99, max)"""
+        try:
+            conn = self._connect()
+            recorded_at = _utc_now()
+            with conn:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO stage_latency (recorded_at, stage, samples, p50, p90, p99, max)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(recorded_at, *row) for row in rows])
+            return True
+            
+        except Exception as e:
+            print(f"Error saving stage latency: {e}")
+            self._rollback()
+            return False
+    
+    def get_stage_latency(self, limit: int = 12) -> Dict[str, List[Dict]]:
+        """Возвращает последние сохранённые перцентили по каждому этапу (от новых к старым)"""
+        try:
+            conn = self._connect()
+            rows = conn.execute('''
+                SELECT stage, recorded_at, samples, p50, p90, p99, max FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY stage ORDER BY recorded_at DESC) AS n
+                    FROM stage_latency
+                ) WHERE n <= ? ORDER BY stage, recorded_at DESC
+            ''', (limit,)).fetchall()
+            
+            result = {}
+            for row in rows:
+                result.setdefault(row[0], []).append({
+                    'recorded_at': row[1],
+                    'samples': row[2],
+                    'p50': row[3],
+                    'p90': row[4],
+                    'p99': row[5],
+                    'max': row[6]
+                })
+            return result
+            
+        except Exception as e:
+            print(f"Error getting stage latency: {e}")
+            return {}
+    
+    def create_broadcast(self, admin_id: int, text: str, total: int, 
+                         progress_message_id: int = None) -> Optional[int]:
+        """Создаёт запись о рассылке и возвращает её ID"""
+        try:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute('''
+                    INSERT INTO broadcasts (admin_id, text, total, progress_message_id, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (admin_id, text, total, progress_message_id, datetime.now().isoformat()))
+            return cursor.lastrowid
+            
+        except Exception as e:
+            print(f"Error creating broadcast: {e}")
+            self._rollback()
+            return None
+    
+    def update_broadcast(self, broadcast_id: int, last_user_id: int, sent: int, 
+                         failed: int, blocked: int, status: str = 'running') -> bool:
+        """Сохраняет курсор и счётчики рассылки"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('''
+                    UPDATE broadcasts SET 
+                        last_user_id = ?, sent = ?, failed = ?, blocked = ?, 
+                        status = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (last_user_id, sent, failed, blocked, status, 
+                      datetime.now().isoformat(), broadcast_id))
+            return True
+            
+        except Exception as e:
+            print(f"Error updating broadcast: {e}")
+            self._rollback()
+            return False
+    
+    def get_unfinished_broadcasts(self) -> List[Dict]:
+        """Возвращает рассылки, прерванные остановкой бота"""
+        try:
+            conn = self._connect()
+            cursor = conn.execute('''
+                SELECT id, admin_id, text, last_user_id, total, sent, failed, blocked, progress_message_id
+                FROM broadcasts WHERE status = 'running' ORDER BY id
+            ''')
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            
+        except Exception as e:
+            print(f"Error getting broadcasts: {e}")
+            return []
+    
+    def get_file_id(self, video_id: str, format_id: str) -> Optional[str]:
+        """Возвращает Telegram file_id ранее отправленного видео"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                'SELECT file_id FROM video_files WHERE video_id = ? AND format_id = ?',
+                (video_id, format_id or '')
+            )
+            row = cursor.fetchone()
+            
+            return row[0] if row else None
+            
+        except Exception as e:
+            print(f"Error getting file_id: {e}")
+            return None
+    
+    def find_file_id(self, video_id: str, max_bytes: int) -> Optional[tuple]:
+        """Ищет отправленное видео, формат которого выбирался под тот же лимит размера.
+        
+        Возвращает (format_id, file_id, file_size, title) или None.
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT format_id, file_id, file_size, title FROM video_files 
+                WHERE video_id = ? AND max_bytes = ?
+                ORDER BY created_at DESC LIMIT 1
+            ''', (video_id, max_bytes))
+            row = cursor.fetchone()
+            
+            return tuple(row) if row else None
+            
+        except Exception as e:
+            print(f"Error finding file_id: {e}")
+            return None
+    
+    def save_file_id(self, video_id: str, format_id: str, file_id: str, file_size: int = None,
+                     max_bytes: int = None, title: str = None) -> bool:
+        """Сохраняет file_id отправленного видео и лимит размера, под который выбран формат"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO video_files (video_id, format_id, file_id, file_size, created_at, 
+                                                    max_bytes, title)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (video_id, format_id or '', file_id, file_size, datetime.now().isoformat(), max_bytes, title))
+            
+            conn.commit()
+            return True
+            
+        except Exception as e:
+            print(f"Error saving file_id: {e}")
+            self._rollback()
+            return False
+    
+    def delete_file_id(self, video_id: str, format_id: str) -> bool:
+        """Удаляет устаревший file_id"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                'DELETE FROM video_files WHERE video_id = ? AND format_id = ?',
+                (video_id, format_id or '')
+            )
+            
+            conn.commit()
+            return True
+            
+        except Exception as e:
+            print(f"Error deleting file_id: {e}")
+            self._rollback()
+            return False
+    
+    def get_user_info(self, user_id: int) -> Optional[Dict]:
+        """Получает полную информацию о пользователе"""
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            # Получаем информацию о пользователе
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            user_row = cursor.fetchone()
+            
+            if not user_row:
+                return None
+            
+            # Получаем загрузки пользователя
+            cursor.execute('''
+                SELECT video_url, video_title, download_time, file_size, success 
+                FROM downloads WHERE user_id = ? AND reject_reason IS NULL
+                ORDER BY download_time DESC
+            ''', (user_id,))
+            downloads = cursor.fetchall()
+            
+            
+            # Формируем результат
+            columns = [description[0] for description in cursor.description if description[0] != 'user_id']
+            user_info = dict(zip(['user_id'] + columns[:-1], user_row))
+            
+            user_info['downloads'] = [
+                {
+                    'video_url': d[0],
+                    'video_title': d[1],
+                    'download_time': d[2],
+                    'file_size': d[3],
+                    'success': bool(d[4])
+                }
+                for d in downloads
+            ]
+            
+            return user_info
+            
+        except Exception as e:
+            print(f"Error getting user info: {e}")
+            return None
+    
+    def get_all_users(self) -> List[Dict]:
+        """Получает информацию о всех пользователях (для больших баз используйте iter_users)"""
+        return list(self.iter_users(include_downloads=True))
+    
+    def iter_users(self, include_downloads: bool = False, chunk_size: int = 1000, 
+                   since: str = None) -> Iterator[Dict]:
+        """Потоково отдаёт пользователей страницами по user_id.
+        
+        С include_downloads загрузки страницы берутся одним упорядоченным JOIN,
+        поэтому в памяти одновременно находится не больше одной страницы.
+        since ограничивает выборку пользователями с last_interaction >= since.
+        """
+        self.flush()
+        last_id = MIN_USER_ID
+        if since:
+            # Полная ISO-строка: иначе SQLite сравнит её с колонкой как число
+            since = datetime.fromisoformat(str(since)).isoformat()
+        condition = 'AND last_interaction >= ?' if since else ''
+        extra = (since,) if since else ()
+        
+        try:
+            while True:
+                conn = self._connect()
+                
+                if include_downloads:
+                    rows = conn.execute(f'''
+                        SELECT {USER_COLUMNS_U}, 
+                               d.video_url, d.video_title, d.download_time, d.file_size, d.success
+                        FROM (
+                            SELECT * FROM users WHERE user_id > ? {condition} 
+                            ORDER BY user_id LIMIT ?
+                        ) u
+                        LEFT JOIN downloads d ON d.user_id = u.user_id AND d.reject_reason IS NULL
+                        ORDER BY u.user_id, d.download_time DESC
+                    ''', (last_id, *extra, chunk_size)).fetchall()
+                else:
+                    rows = conn.execute(f'''
+                        SELECT {USER_COLUMNS} FROM users 
+                        WHERE user_id > ? {condition} ORDER BY user_id LIMIT ?
+                    ''', (last_id, *extra, chunk_size)).fetchall()
+                
+                count = 0
+                user_info = None
+                for row in rows:
+                    if user_info is None or user_info['user_id'] != row[0]:
+                        if user_info is not None:
+                            yield user_info
+                        user_info = _user_from_row(row)
+                        count += 1
+                        if include_downloads:
+                            user_info['downloads'] = []
+                    
+                    if include_downloads and row[11] is not None:
+                        user_info['downloads'].append({
+                            'video_url': row[11],
+                            'video_title': row[12],
+                            'download_time': row[13],
+                            'file_size': row[14],
+                            'success': bool(row[15])
+                        })
+                
+                if user_info is not None:
+                    last_id = user_info['user_id']
+                    yield user_info
+                
+                if count < chunk_size:
+                    break
+                    
+        except Exception as e:
+            print(f"Error iterating users: {e}")
+    
+    def iter_user_ids(self, active_only: bool = True, chunk_size: int = 5000, 
+                      after_id: int = None) -> Iterator[int]:
+        """Потоково отдаёт только ID пользователей (для рассылок); after_id — курсор продолжения"""
+        self.flush()
+        last_id = MIN_USER_ID if after_id is None else after_id
+        condition = 'AND is_active = 1' if active_only else ''
+        
+        try:
+            while True:
+                conn = self._connect()
+                rows = conn.execute(f'''
+                    SELECT user_id FROM users 
+                    WHERE user_id > ? {condition} ORDER BY user_id LIMIT ?
+                ''', (last_id, chunk_size)).fetchall()
+                
+                for row in rows:
+                    yield row[0]
+                
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1][0]
+                
+        except Exception as e:
+            print(f"Error iterating user ids: {e}")
+    
+    def export_to_json(self, filepath: str = None) -> str:
+        """Экспортирует всех пользователей в JSON (потоково, одним файлом)"""
+        if not filepath:
+            filepath = f'users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+        
+        writer = _ExportWriter(filepath, fmt='json', compress=False, max_part_size=None)
+        try:
+            for user in self.iter_users(include_downloads=True):
+                writer.write(user)
+        finally:
+            writer.close()
+        
+        return filepath
+    
+    def export_users(self, directory: str = None, fmt: str = 'json', compress: bool = True,
+                     since: str = None, max_part_size: int = EXPORT_PART_SIZE) -> List[str]:
+        """Потоково экспортирует пользователей с загрузками в файлы-части.
+        
+        fmt — 'json' (каждая часть — самостоятельный документ) или 'ndjson';
+        since — ISO-время, при указании выгружаются только пользователи,
+        активные начиная с этого момента. Возвращает список созданных файлов.
+        """
+        directory = directory or tempfile.gettempdir()
+        base_path = os.path.join(directory, f'users_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+        
+        writer = _ExportWriter(base_path, fmt=fmt, compress=compress, 
+                               max_part_size=max_part_size, since=since)
+        try:
+            for user in self.iter_users(include_downloads=True, since=since):
+                writer.write(user)
+        finally:
+            writer.close()
+        
+        return writer.parts
+    
+    def export_to_sql(self, filepath: str = None) -> str:
+        """Экспортирует базу данных в SQL файл (дамп строится по снимку, а не по рабочей базе)"""
+        if not filepath:
+            filepath = f'database_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.sql'
+        
+        result = self.export_snapshot(mode='sql', compress=False, filepath=filepath)
+        return result['path'] if result else None
+    
+    def export_snapshot(self, mode: str = 'sql', compress: bool = True, filepath: str = None) -> Optional[Dict]:
+        """Снимает согласованную копию базы через backup API и экспортирует её.
+        
+        Копирование выполняется за один шаг: в режиме WAL оно держит только
+        снимок чтения и не блокирует писателей. Пошаговый backup перезапускался бы
+        после каждой записи в базу и под нагрузкой мог не завершиться. mode — 'db' (файл базы)
+        или 'sql' (дамп, построенный по снимку). Возвращает путь и пропускную способность.
+        """
+        self.flush()
+        if mode not in ('db', 'sql'):
+            raise ValueError(f"Unknown snapshot mode: {mode}")
+        
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if not filepath:
+            filepath = os.path.join(tempfile.gettempdir(), f'database_export_{stamp}.{mode}')
+            if compress:
+                filepath += '.gz'
+        snapshot_path = os.path.join(tempfile.gettempdir(), f'database_snapshot_{stamp}_{os.getpid()}.db')
+        
+        try:
+            started = time.monotonic()
+            
+            # Отдельные соединения: backup не должен занимать соединения рабочих потоков
+            source = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+            snapshot = sqlite3.connect(snapshot_path)
+            try:
+                source.backup(snapshot)
+            finally:
+                source.close()
+            
+            size = os.path.getsize(snapshot_path)
+            opener = gzip.open if compress else open
+            
+            if mode == 'sql':
+                with opener(filepath, 'wt', encoding='utf-8') as f:
+                    # Добавляем заголовок
+                    f.write(f"-- Database export created at {datetime.now().isoformat()}\n")
+                    f.write("-- Bot Database Export\n\n")
+                    
+                    # Экспортируем схему и данные из снимка
+                    for line in snapshot.iterdump():
+                        f.write(f"{line}\n")
+                snapshot.close()
+            else:
+                snapshot.close()
+                with open(snapshot_path, 'rb') as src, opener(filepath, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            
+            seconds = time.monotonic() - started
+            return {
+                'path': filepath,
+                'bytes': size,
+                'seconds': seconds,
+                'throughput': size / seconds / 1024 / 1024 if seconds > 0 else 0
+            }
+            
+        except Exception as e:
+            print(f"Error exporting snapshot: {e}")
+            return None
+        
+        finally:
+            try:
+                os.remove(snapshot_path)
+            except OSError:
+                pass
+    
+    def get_statistics(self) -> Dict:
+        """Получает статистику по базе данных (O(1): счётчики и индекс по total_downloads)"""
+        try:
+            counters = self.get_counters()
+            total_downloads = counters.get('total_downloads', 0)
+            successful_downloads = counters.get('successful_downloads', 0)
+            
+            # Топ пользователей по загрузкам
+            conn = self._connect()
+            top_users = conn.execute('''
+                SELECT user_id, username, first_name, total_downloads
+                FROM users
+                ORDER BY total_downloads DESC
+                LIMIT 10
+            ''').fetchall()
+            
+            return {
+                'total_users': counters.get('total_users', 0),
+                'active_users': counters.get('active_users', 0),
+                'total_downloads': total_downloads,
+                'successful_downloads': successful_downloads,
+                'success_rate': (successful_downloads / total_downloads * 100) if total_downloads > 0 else 0,
+                'rejected_downloads': counters.get('rejected_downloads', 0),
+                'rejections': {
+                    name.split(':', 1)[1]: value
+                    for name, value in counters.items() if name.startswith('rejected_downloads:')
+                },
+                'top_users': [
+                    {
+                        'user_id': row[0],
+                        'username': row[1],
+                        'first_name': row[2],
+                        'download_count': row[3]
+                    }
+                    for row in top_users
+                ],
+                'daily': self.get_trends('day', 7)
+            }
+            
+        except Exception as e:
+            print(f"Error getting statistics: {e}")
+            return {}
+
+# Создаем глобальный экземпляр менеджера базы данных
 db_manager = DatabaseManager()
\ No newline at end of file
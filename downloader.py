@@ -1,62 +1,270 @@
-import os
-import yt_dlp
-import uuid
-from pathlib import Path
-
-class Download:
-    def __init__(self, url):
-        self.url = url
-        self.file = None
-        self.download_video()
-    
-    def download_video(self):
-        """Скачивает оригинальное видео в высоком качестве"""
-        try:
-            # Создаем папку для загрузок
-            downloads_dir = Path("downloads")
-            downloads_dir.mkdir(exist_ok=True)
-            
-            # Генерируем имя файла
-            file_id = str(uuid.uuid4())[:8]
-            output_path = downloads_dir / f"video_{file_id}.%(ext)s"
-            
-            # Настройки для скачивания оригинального видео в высоком качестве
-            ydl_opts = {
-                # Приоритет: высокое качество в форматах, поддерживаемых Telegram
-                'format': (
-                    'best[height>=2160][ext=mp4]/'
-                    'best[height>=1440][ext=mp4]/'
-                    'best[height>=1080][ext=mp4]/'
-                    'bestvideo[height>=2160][ext=mp4]+bestaudio[ext=m4a]/best[height>=2160]/'
-                    'bestvideo[height>=1440][ext=mp4]+bestaudio[ext=m4a]/best[height>=1440]/'
-                    'bestvideo[height>=1080][ext=mp4]+bestaudio[ext=m4a]/best[height>=1080]/'
-                    'best[ext=mp4]/'
-                    'best'
-                ),
-                'outtmpl': str(output_path),
-                'noplaylist': True,
-                'merge_output_format': 'mp4',
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url])
-                
-                # Находим скачанный файл
-                for file in downloads_dir.glob(f"video_{file_id}.*"):
-                    if file.is_file():
-                        self.file = str(file)
-                        break
-                
-                if not self.file:
-                    raise Exception("Файл не найден после скачивания")
-                    
-        except Exception as e:
-            raise Exception(f"Ошибка: {str(e)}")
-    
-    def cleanup(self):
-        """Удаляет файл"""
-        if self.file and os.path.exists(self.file):
-            try:
-                os.remove(self.file)
-            except:
-                pass
\ No newline at end of file
+import os
+import copy
+import functools
+import logging
+import yt_dlp
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from yt_dlp.downloader.external import get_external_downloader
+from yt_dlp.postprocessor import FFmpegMergerPP
+import config
+import urls
+from cache import TTLCache
+
+# Общие настройки yt-dlp для извлечения метаданных
+BASE_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    # Прогресс показывают хуки в сообщении пользователю, а не строка в консоли
+    'noprogress': True,
+}
+
+# Приоритет: высокое качество в форматах, поддерживаемых Telegram
+VIDEO_FORMAT = (
+    'best[height>=2160][ext=mp4]/'
+    'best[height>=1440][ext=mp4]/'
+    'best[height>=1080][ext=mp4]/'
+    'bestvideo[height>=2160][ext=mp4]+bestaudio[ext=m4a]/best[height>=2160]/'
+    'bestvideo[height>=1440][ext=mp4]+bestaudio[ext=m4a]/best[height>=1440]/'
+    'bestvideo[height>=1080][ext=mp4]+bestaudio[ext=m4a]/best[height>=1080]/'
+    'best[ext=mp4]/'
+    'best'
+)
+
+# Аргументы внешних загрузчиков, ограничивающие число соединений ({n}) на один файл
+CONNECTION_ARGS = {
+    'aria2c': ['-x{n}', '-s{n}', '-j{n}'],
+    'axel': ['-n', '{n}'],
+}
+
+# Кэш info-словарей по ID видео, чтобы популярные ролики не извлекались повторно
+info_cache = TTLCache(maxsize=config.info_cache_size, ttl=config.info_cache_ttl)
+
+def extract_info(url):
+    """Извлекает метаданные видео один раз; результат кэшируется по ID видео"""
+    video_id = urls.extract_video_id(url)
+    if video_id:
+        info = info_cache.get(video_id)
+        if info is not None:
+            return copy.deepcopy(info)
+    
+    # process=False: выбор формата и загрузка выполняются позже в Download
+    with yt_dlp.YoutubeDL(BASE_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+    
+    info_cache.set(info.get('id') or video_id or url, info)
+    return copy.deepcopy(info)
+
+@functools.lru_cache(maxsize=None)
+def _external_downloader():
+    """Имя внешнего загрузчика из настроек, если он установлен, иначе None"""
+    name = config.external_downloader
+    if not name:
+        return None
+    fd = get_external_downloader(name)
+    if fd is None or not fd.available():
+        logging.warning(f"External downloader {name} is not available, using the built-in downloader")
+        return None
+    return name
+
+@functools.lru_cache(maxsize=None)
+def merger_available():
+    """Найден ли ffmpeg для склейки параллельно скачанных потоков"""
+    return FFmpegMergerPP(None).available
+
+def download_opts(streams=1):
+    """Сетевые настройки yt-dlp для одной задачи, которая качает streams файлов одновременно.
+
+    Лимит соединений внешнего загрузчика задан на задачу и делится между потоками.
+    """
+    opts = {'concurrent_fragment_downloads': config.concurrent_fragment_downloads}
+    name = _external_downloader()
+    if name:
+        key = os.path.splitext(os.path.basename(name))[0].lower()
+        connections = max(1, config.external_downloader_connections // streams)
+        opts['external_downloader'] = {'default': name}
+        opts['external_downloader_args'] = {
+            key: [arg.format(n=connections) for arg in CONNECTION_ARGS.get(key, [])]
+        }
+    return opts
+
+class FormatTooLargeError(Exception):
+    """Ни одна комбинация форматов не укладывается в лимит размера"""
+
+def estimate_size(fmt, duration):
+    """Оценивает размер формата в байтах: filesize, filesize_approx или tbr × длительность"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        # tbr указан в Кбит/с
+        return int(fmt['tbr'] * 1000 / 8 * duration)
+    return None
+
+def _is_h264(fmt):
+    return fmt.get('ext') == 'mp4' and (fmt.get('vcodec') or '').startswith('avc')
+
+def _is_aac(fmt):
+    return fmt.get('ext') == 'm4a' or (fmt.get('acodec') or '').startswith('mp4a')
+
+def _quality(video, audio=None):
+    """Ключ сравнения вариантов: сначала совместимость с Telegram, затем качество.
+
+    Совместимы, как и в VIDEO_FORMAT, готовые mp4 с H.264 и пары видео mp4 (H.264)
+    + аудио m4a; VP9/AV1 и opus выбираются, только если совместимый вариант не
+    укладывается в лимит.
+    """
+    if audio is None:
+        compatible = _is_h264(video) and _is_aac(video)
+    else:
+        compatible = _is_h264(video) and _is_aac(audio)
+    return (compatible, video.get('height') or 0, video.get('tbr') or 0)
+
+def _candidates(info):
+    """Перечисляет варианты (format_id, оценка размера, качество): готовые файлы и пары видео+аудио"""
+    formats = [f for f in info.get('formats') or [] if f.get('format_id') and f.get('ext') != 'mhtml']
+    duration = info.get('duration')
+    
+    videos = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('acodec') == 'none']
+    audios = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('vcodec') == 'none']
+    # Для контейнера mp4 предпочитаем аудио m4a
+    audios.sort(key=lambda f: (f.get('ext') == 'm4a', f.get('abr') or f.get('tbr') or 0), reverse=True)
+    
+    for fmt in formats:
+        if fmt.get('vcodec') not in (None, 'none') and fmt.get('acodec') not in (None, 'none'):
+            yield fmt['format_id'], estimate_size(fmt, duration), _quality(fmt)
+    
+    for video in videos:
+        video_size = estimate_size(video, duration)
+        for audio in audios:
+            audio_size = estimate_size(audio, duration)
+            size = video_size + audio_size if video_size and audio_size else None
+            yield f"{video['format_id']}+{audio['format_id']}", size, _quality(video, audio)
+
+def select_format(info, max_bytes=None):
+    """Выбирает лучшую пару видео+аудио, укладывающуюся в лимит размера.
+
+    Возвращает (format_id, оценка размера в байтах). Если у форматов нет
+    данных о размере, выбор делегируется yt-dlp и оценка равна None.
+    """
+    max_bytes = max_bytes or config.max_file_size
+    best = None
+    smallest = None
+    
+    for format_id, size, quality in _candidates(info):
+        if size is None:
+            continue
+        if smallest is None or size < smallest:
+            smallest = size
+        if size <= max_bytes and (best is None or quality > best[2]):
+            best = (format_id, size, quality)
+    
+    if best:
+        return best[0], best[1]
+    
+    if smallest is not None:
+        raise FormatTooLargeError(
+            f"Відео завелике: найменший варіант ≈ {smallest / 1024 / 1024:.0f} МБ, "
+            f"ліміт {max_bytes / 1024 / 1024:.0f} МБ"
+        )
+    
+    # Размеры неизвестны — используем прежний выбор yt-dlp, размер проверится после загрузки
+    with yt_dlp.YoutubeDL({**BASE_OPTS, 'format': VIDEO_FORMAT}) as ydl:
+        result = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    return result.get('format_id'), None
+
+class Download:
+    """Скачивает видео по шаблону output_template; файлом дальше владеет кэш загрузок"""
+    
+    def __init__(self, url, output_template, info=None, format_id=None,
+                 progress_hooks=None, postprocessor_hooks=None):
+        self.url = url
+        self.info = info if info is not None else extract_info(url)
+        self.format_id = format_id
+        self.output_template = output_template
+        self.progress_hooks = progress_hooks or []
+        self.postprocessor_hooks = postprocessor_hooks or []
+        self.file = None
+        self.download_video()
+    
+    def download_video(self):
+        """Скачивает оригинальное видео в высоком качестве"""
+        try:
+            # Имя файла задаёт кэш загрузок
+            output_path = Path(self.output_template)
+            downloads_dir = output_path.parent
+            pattern = output_path.name.replace('%(ext)s', '*')
+            
+            # Создаем папку для загрузок
+            downloads_dir.mkdir(exist_ok=True)
+            
+            # Настройки для скачивания оригинального видео в высоком качестве
+            ydl_opts = {
+                **BASE_OPTS,
+                'format': self.format_id or VIDEO_FORMAT,
+                'outtmpl': str(output_path),
+                'merge_output_format': 'mp4',
+                'progress_hooks': self.progress_hooks,
+                'postprocessor_hooks': self.postprocessor_hooks,
+            }
+            
+            format_ids = (self.format_id or '').split('+')
+            if config.parallel_streams and len(format_ids) > 1 and merger_available():
+                self.download_streams(ydl_opts, output_path, format_ids)
+            else:
+                with yt_dlp.YoutubeDL({**ydl_opts, **download_opts()}) as ydl:
+                    # Повторно страницу не загружаем — используем уже извлечённые метаданные
+                    ydl.process_ie_result(copy.deepcopy(self.info), download=True)
+            
+            # Находим скачанный файл (без промежуточных .fNNN.* и .part)
+            for file in downloads_dir.glob(pattern):
+                if file.is_file() and len(file.suffixes) == 1:
+                    self.file = str(file)
+                    break
+            
+            if not self.file:
+                raise Exception("Файл не найден после скачивания")
+                    
+        except Exception as e:
+            raise Exception(f"Ошибка: {str(e)}")
+    
+    def download_streams(self, ydl_opts, output_path, format_ids):
+        """Качает видео и аудио одновременно (каждый поток своим соединением) и склеивает их ffmpeg"""
+        # Промежуточные файлы .fNNN.* так же, как при склейке внутри yt-dlp
+        stream_names = {format_id: output_path.name.replace('.%(ext)s', f'.f{format_id}.%(ext)s')
+                        for format_id in format_ids}
+        
+        def fetch(format_id):
+            opts = {
+                **ydl_opts,
+                **download_opts(streams=len(format_ids)),
+                'format': format_id,
+                'outtmpl': str(output_path.parent / stream_names[format_id]),
+            }
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                return ydl.process_ie_result(copy.deepcopy(self.info), download=True)['requested_downloads'][0]
+        
+        try:
+            # Ждём все потоки, даже если один упал, чтобы не удалять файлы из-под работающей загрузки
+            with ThreadPoolExecutor(max_workers=len(format_ids), thread_name_prefix='stream') as pool:
+                futures = [pool.submit(fetch, format_id) for format_id in format_ids]
+            streams = [future.result() for future in futures]
+            
+            files = [stream['filepath'] for stream in streams]
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                merger = FFmpegMergerPP(ydl)
+                merger.run({
+                    **streams[0],
+                    'filepath': str(output_path).replace('%(ext)s', ydl_opts['merge_output_format']),
+                    'requested_formats': streams,
+                    '__files_to_merge': files,
+                })
+        finally:
+            # Недокачанные и склеенные потоки (.part, .ytdl, фрагменты) вне бюджета кэша загрузок
+            for name in stream_names.values():
+                for file in output_path.parent.glob(name.replace('%(ext)s', '*')):
+                    try:
+                        file.unlink()
+                    except OSError:
+                        pass
\ No newline at end of file
@@ -0,0 +1,319 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import logsetup
+
+
+class RetryDownload(Exception):
+    """Бросается на этапе отправки, чтобы вернуть задачу на повторное скачивание"""
+
+
+class Deferred(Exception):
+    """Бросается на этапе скачивания, если задача ждёт результата чужой загрузки"""
+
+
+class DownloadJob:
+    """Задача на скачивание одного видео"""
+
+    def __init__(self, message, user_id, url, video_id=None):
+        self.message = message
+        self.user_id = user_id
+        self.chat_id = message.chat.id
+        self.url = url
+        self.status_message_id = None
+        self.position = 0
+        self.video_title = None
+        self.file_size = None
+        self.info = None
+        self.video_id = video_id
+        self.format_id = None
+        self.estimated_size = None
+        self.file_id = None
+        self.retried = False
+        self.flight = None
+        self.batch = None
+        self.success = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        # Строки лога воркеров связываются с исходным сообщением
+        self.request_id = logsetup.request_id.get()
+        # Длительность этапов обработки (сек): queue, extract, download, merge, upload
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Замеряет длительность этапа и добавляет её в timings"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.monotonic() - started
+
+
+class JobQueue:
+    """Ограниченная очередь загрузок с отдельными пулами воркеров скачивания и отправки.
+
+    download_handler(job) выполняет тяжёлую загрузку, upload_handler(job) — отправку
+    в Telegram, finish_handler(job, error) вызывается ровно один раз для каждой задачи
+    (запись в базу, очистка файлов, сообщение об ошибке).
+    """
+
+    def __init__(self, download_handler, upload_handler, finish_handler,
+                 max_size=100, download_workers=2, upload_workers=2):
+        self.download_handler = download_handler
+        self.upload_handler = upload_handler
+        self.finish_handler = finish_handler
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self._downloads = queue.Queue(maxsize=max_size)
+        self._uploads = queue.Queue()
+        self._threads = []
+        self._active = 0
+        self._stopping = False
+        self._lock = threading.Lock()
+        # Время ожидания последних задач в очереди (сек)
+        self._waits = deque(maxlen=200)
+
+    def start(self):
+        for i in range(self.download_workers):
+            self._spawn(self._download_loop, f'download-{i}')
+        for i in range(self.upload_workers):
+            self._spawn(self._upload_loop, f'upload-{i}')
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, job):
+        """Ставит задачу в очередь.
+
+        Возвращает позицию в очереди (0 — загрузка начнётся сразу) или None,
+        если очередь переполнена.
+        """
+        with self._lock:
+            try:
+                self._downloads.put_nowait(job)
+            except queue.Full:
+                return None
+            # Позиция среди ожидающих с учётом свободных воркеров
+            return max(0, self._downloads.qsize() + self._active - self.download_workers)
+
+    def stats(self):
+        """Текущая глубина очередей и время ожидания"""
+        waits = list(self._waits)
+        return {
+            'depth': self._downloads.qsize(),
+            'active': self._active,
+            'uploads': self._uploads.qsize(),
+            'avg_wait': sum(waits) / len(waits) if waits else 0,
+            'max_wait': max(waits) if waits else 0,
+        }
+
+    def resume(self, job):
+        """Передаёт отложенную задачу на этап отправки"""
+        self._uploads.put(job)
+
+    def fail(self, job, error):
+        """Завершает отложенную задачу с ошибкой"""
+        self._finish(job, error)
+
+    def stop(self, timeout=None):
+        """Дожидается обработки уже принятых задач и останавливает воркеры"""
+        with self._lock:
+            # Повторные скачивания после этого не принимаются: их некому было бы выполнить
+            self._stopping = True
+        for _ in range(self.download_workers):
+            self._downloads.put(None)
+        for thread in self._threads[:self.download_workers]:
+            thread.join(timeout)
+        for _ in range(self.upload_workers):
+            self._uploads.put(None)
+        for thread in self._threads[self.download_workers:]:
+            thread.join(timeout)
+
+    def _download_loop(self):
+        while True:
+            job = self._downloads.get()
+            if job is None:
+                break
+
+            with self._lock:
+                self._active += 1
+            logsetup.request_id.set(job.request_id)
+            job.started_at = time.monotonic()
+            self._waits.append(job.started_at - job.enqueued_at)
+            job.timings['queue'] = job.timings.get('queue', 0) + job.started_at - job.enqueued_at
+
+            try:
+                self.download_handler(job)
+            except Deferred:
+                # Задачу продолжит resume()/fail() после завершения общей загрузки
+                pass
+            except Exception as e:
+                self._finish(job, e)
+            else:
+                self._uploads.put(job)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def _upload_loop(self):
+        while True:
+            job = self._uploads.get()
+            if job is None:
+                break
+
+            logsetup.request_id.set(job.request_id)
+            try:
+                self.upload_handler(job)
+            except RetryDownload:
+                if not self._requeue(job):
+                    self._finish(job, Exception("Не удалось повторно поставить видео в очередь, попробуйте позже"))
+            except Exception as e:
+                self._finish(job, e)
+            else:
+                self._finish(job, None)
+
+    def _requeue(self, job):
+        """Возвращает задачу на скачивание, не блокируя воркер отправки.
+
+        False — очередь переполнена или останавливается.
+        """
+        with self._lock:
+            if self._stopping:
+                return False
+            job.enqueued_at = time.monotonic()
+            try:
+                self._downloads.put_nowait(job)
+            except queue.Full:
+                return False
+        return True
+
+    def _finish(self, job, error):
+        # Ожидающие задачи завершаются в потоке лидера — временно берём их request_id
+        token = logsetup.request_id.set(job.request_id)
+        try:
+            self.finish_handler(job, error)
+        except Exception as e:
+            logging.error(f"Job finish handler failed for user {job.user_id}: {e}")
+        finally:
+            logsetup.request_id.reset(token)
+
+
+class Batch:
+    """Ссылки из одного сообщения: в очереди одновременно не больше parallelism задач пакета"""
+
+    def __init__(self, parallelism=2):
+        self.parallelism = parallelism
+        self.jobs = []
+        self._pending = deque()
+        self._active = 0
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        job.batch = self
+        self.jobs.append(job)
+        with self._lock:
+            self._pending.append(job)
+            self._remaining += 1
+
+    def take(self):
+        """Забирает задачи, которые можно поставить в очередь сейчас"""
+        taken = []
+        with self._lock:
+            while self._pending and self._active < self.parallelism:
+                taken.append(self._pending.popleft())
+                self._active += 1
+        return taken
+
+    def finish(self):
+        """Отмечает завершение задачи пакета; True — завершена последняя"""
+        with self._lock:
+            self._active -= 1
+            self._remaining -= 1
+            return self._remaining == 0
+
+    def cancel(self):
+        """Снимает ещё не поставленные задачи; возвращает (задачи, завершён ли пакет)"""
+        with self._lock:
+            cancelled, self._pending = list(self._pending), deque()
+            self._remaining -= len(cancelled)
+            return cancelled, bool(cancelled) and self._remaining == 0
+
+
+class Flight:
+    """Общая загрузка одного видео для всех одновременных запросов"""
+
+    def __init__(self, key):
+        self.key = key
+        self.file = None
+        self.file_size = None
+        self.file_id = None
+        self.error = None
+        self.done = False
+        self.waiters = []
+        self.refs = 1
+        # Прогресс загрузки лидера; ожидающие подписываются на него своими сообщениями
+        self.progress = None
+        # Сериализует отправку: первый загружает файл, остальные используют его file_id
+        self.upload_lock = threading.Lock()
+
+
+class SingleFlight:
+    """Объединяет одновременные загрузки по ключу (ID видео, формат).
+
+    Первый запрос становится лидером и скачивает файл, остальные ждут его
+    результата. Очистка выполняется после того, как последний участник
+    вызовет release().
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Возвращает (flight, лидер ли вызывающий)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.refs += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            return flight, True
+
+    def attach(self, flight, job):
+        """Возвращает True, если результат уже готов; иначе ставит задачу в ожидание"""
+        with self._lock:
+            if flight.done:
+                return True
+            flight.waiters.append(job)
+            return False
+
+    def complete(self, flight, error=None):
+        """Фиксирует результат лидера и возвращает ожидающие задачи"""
+        with self._lock:
+            flight.error = error
+            flight.done = True
+            if error is not None and self._flights.get(flight.key) is flight:
+                # Новые запросы не должны получать ошибку — они начнут загрузку заново
+                del self._flights[flight.key]
+            waiters, flight.waiters = flight.waiters, []
+            return waiters
+
+    def release(self, flight):
+        """Уменьшает счётчик ссылок; возвращает True для последнего участника"""
+        with self._lock:
+            flight.refs -= 1
+            if flight.refs > 0:
+                return False
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return True
+
+    def __len__(self):
+        return len(self._flights)
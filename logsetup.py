@@ -0,0 +1,108 @@
+"""Неблокирующее логирование: обработчики потоков кладут записи в очередь,
+а запись в файл (с ротацией) и в консоль выполняет фоновый QueueListener.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from datetime import datetime, timezone
+from ratelimit import TokenBucket
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(request_id)s - %(message)s'
+
+# ID текущего запроса (обновления Telegram или задачи загрузки) для связывания строк лога
+request_id = contextvars.ContextVar('request_id', default='-')
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи request_id; работает в потоке, который пишет в лог"""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает не больше rate записей в секунду (burst подряд), остальные отбрасывает.
+
+    Число отброшенных записей дописывается к следующей пропущенной.
+    """
+
+    def __init__(self, rate=10, burst=None):
+        super().__init__()
+        self.bucket = TokenBucket(rate, capacity=burst)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.bucket.try_acquire():
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.msg = f"{record.msg} (+{dropped} similar suppressed)"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging(level='INFO', path='bot.log', max_bytes=10 * 1024 * 1024, backup_count=5,
+                  rotate_when=None, json_format=False, sampled_loggers=(), sample_rate=10):
+    """Настраивает корневой логгер и возвращает запущенный QueueListener.
+
+    rotate_when (например, 'midnight') включает ротацию по времени вместо ротации по размеру.
+    Логгеры из sampled_loggers проходят через SamplingFilter с лимитом sample_rate записей/сек.
+    """
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(path, when=rotate_when,
+                                                                 backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes,
+                                                            backupCount=backup_count, encoding='utf-8')
+    console_handler = logging.StreamHandler()
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    # SimpleQueue не ограничена и не блокирует пишущий поток
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    for name in sampled_loggers:
+        logging.getLogger(name).addFilter(SamplingFilter(sample_rate))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    # Дописываем оставшиеся в очереди записи при завершении процесса
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,265 @@
+"""Встроенные метрики: гистограммы этапов, счётчики и HTTP-эндпоинт в формате Prometheus.
+
+Проверка: curl http://127.0.0.1:<metrics_port>/metrics
+"""
+import bisect
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм (сек): от быстрых запросов к базе до долгих загрузок
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PERCENTILES = (0.5, 0.9, 0.99)
+# Сколько значений между снимками хранится для расчёта перцентилей
+MAX_PENDING = 10000
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def percentiles(samples, quantiles=PERCENTILES):
+    """Перцентили по выборке (ближайший ранг); пустая выборка — пустой словарь"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Гистограмма с корзинами Prometheus и окном последних значений для перцентилей"""
+
+    def __init__(self, buckets=BUCKETS, window=1000):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._recent = deque(maxlen=window)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            self._recent.append(value)
+            if len(self._pending) < MAX_PENDING:
+                self._pending.append(value)
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def drain(self):
+        """Возвращает значения, накопленные с прошлого вызова"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return pending
+
+
+class Family:
+    """Метрика с метками: отдельный Counter/Histogram на каждый набор значений меток"""
+
+    def __init__(self, name, help, kind, labelnames, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._factory()
+            return child
+
+    def items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class Registry:
+    def __init__(self):
+        self._families = []
+        self._callbacks = []
+
+    def counter(self, name, help, labelnames=()):
+        family = Family(name, help, 'counter', labelnames, Counter)
+        self._families.append(family)
+        return family
+
+    def histogram(self, name, help, labelnames=()):
+        family = Family(name, help, 'histogram', labelnames, Histogram)
+        self._families.append(family)
+        return family
+
+    def callback(self, name, help, kind, func, labelnames=()):
+        """Метрика, значения которой считываются при отдаче: func() -> {(метки...): значение}"""
+        self._callbacks.append((name, help, kind, labelnames, func))
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for family in self._families:
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for values, metric in family.items():
+                labels = _format_labels(family.labelnames, values)
+                if family.kind == 'counter':
+                    lines.append(f'{family.name}{labels} {metric.value}')
+                    continue
+
+                with metric._lock:
+                    counts, total, count = list(metric.counts), metric.sum, metric.count
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, counts):
+                    cumulative += bucket_count
+                    le = _format_labels(family.labelnames, values, ('le', bound))
+                    lines.append(f'{family.name}_bucket{le} {cumulative}')
+                le = _format_labels(family.labelnames, values, ('le', '+Inf'))
+                lines.append(f'{family.name}_bucket{le} {count}')
+                lines.append(f'{family.name}_sum{labels} {total}')
+                lines.append(f'{family.name}_count{labels} {count}')
+
+        for name, help, kind, labelnames, func in self._callbacks:
+            try:
+                values = func()
+            except Exception as e:
+                logging.warning(f"Metric {name} collection failed: {e}")
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for label_values, value in values.items():
+                lines.append(f'{name}{_format_labels(labelnames, label_values)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram('bot_stage_seconds', 'Request processing stage duration in seconds', ('stage',))
+rate_limited = registry.counter('bot_rate_limited_total', 'Bot API 429 responses', ('method',))
+bytes_total = registry.counter('bot_bytes_total', 'Video bytes downloaded from YouTube and uploaded to Telegram',
+                               ('direction',))
+file_id_lookups = registry.counter('bot_file_id_lookups_total', 'file_id cache lookups', ('result',))
+
+
+def observe(stage, seconds):
+    stage_seconds.labels(stage).observe(seconds)
+
+
+def stage_percentiles():
+    """Перцентили этапов по окну последних значений: {этап: {0.5: ..., 'count': ...}}"""
+    result = {}
+    for (stage,), histogram in stage_seconds.items():
+        recent = histogram.recent()
+        if recent:
+            result[stage] = {**percentiles(recent), 'count': histogram.count}
+    return result
+
+
+class StageSnapshotter:
+    """Периодически сохраняет перцентили этапов за прошедший интервал.
+
+    save_func(rows) получает список (stage, samples, p50, p90, p99, max).
+    """
+
+    def __init__(self, save_func, interval=300):
+        self.save_func = save_func
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.snapshot()
+
+    def snapshot(self):
+        rows = []
+        for (stage,), histogram in stage_seconds.items():
+            samples = histogram.drain()
+            if samples:
+                p = percentiles(samples)
+                rows.append((stage, len(samples), p[0.5], p[0.9], p[0.99], max(samples)))
+        if rows:
+            self.save_func(rows)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.error(f"Metrics snapshot failed: {e}")
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics для Prometheus (по умолчанию только на localhost)"""
+
+    def __init__(self, host='127.0.0.1', port=9108, registry=registry):
+        self.registry = registry
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                body = server.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logging.info(f"Metrics endpoint listening on http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from telebot.apihelper import ApiTelegramException
+from ratelimit import TokenBucket
+
+
+def format_bytes(value):
+    for unit in ('Б', 'КБ', 'МБ', 'ГБ'):
+        if value < 1024 or unit == 'ГБ':
+            return f"{value:.1f} {unit}" if unit != 'Б' else f"{int(value)} {unit}"
+        value /= 1024
+
+
+class ProgressReporter:
+    """Редактирует сообщения о статусе загрузки: не чаще min_interval на чат
+    и в пределах общего бюджета правок (rate в секунду на весь бот).
+
+    Слишком частые обновления просто пропускаются — следующее покажет актуальное состояние.
+    """
+
+    def __init__(self, edit_func, min_interval=3, rate=20):
+        self.edit_func = edit_func
+        self.min_interval = min_interval
+        self.bucket = TokenBucket(rate)
+        self._last_edit = {}
+        self._lock = threading.Lock()
+
+    def update(self, chat_id, message_id, text, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_edit.get(chat_id, 0) < self.min_interval:
+                return False
+            if not self.bucket.try_acquire():
+                return False
+            self._last_edit[chat_id] = now
+
+            # Не даём словарю расти бесконечно
+            if len(self._last_edit) > 10000:
+                self._last_edit = {k: v for k, v in self._last_edit.items() if now - v < self.min_interval}
+
+        try:
+            self.edit_func(chat_id, message_id, text)
+            return True
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                # Правки прогресса необязательны — просто прекращаем их на время retry_after
+                self.bucket.pause((e.result_json or {}).get('parameters', {}).get('retry_after', 1))
+            logging.debug(f"Progress edit failed for chat {chat_id}: {e}")
+            return False
+        except Exception as e:
+            # Например, «message is not modified» или сообщение уже удалено
+            logging.debug(f"Progress edit failed for chat {chat_id}: {e}")
+            return False
+
+    def tracker(self, chat_id, message_id, timings=None):
+        return DownloadProgress(self, chat_id, message_id, timings)
+
+
+class DownloadProgress:
+    """progress_hooks/postprocessor_hooks yt-dlp для одной загрузки.
+
+    Показывает процент, скорость и ETA всем подписанным сообщениям (лидеру
+    общей загрузки и ожидающим) и записывает длительность этапа склейки в timings.
+    """
+
+    def __init__(self, reporter, chat_id, message_id, timings=None):
+        self.reporter = reporter
+        self.targets = [(chat_id, message_id)]
+        self.timings = timings if timings is not None else {}
+        self._stage_started = {}
+        self._stream = 0
+        self._last_file = None
+        # Потоки, которые качаются сейчас (видео и аудио могут качаться параллельно)
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def add_target(self, chat_id, message_id):
+        self.targets.append((chat_id, message_id))
+
+    def _show(self, text, force=False):
+        for chat_id, message_id in list(self.targets):
+            if message_id:
+                self.reporter.update(chat_id, message_id, text, force=force)
+
+    def progress_hook(self, d):
+        filename = d.get('filename')
+        with self._lock:
+            if d.get('status') == 'finished':
+                self._active.pop(filename, None)
+                return
+            if d.get('status') != 'downloading':
+                return
+
+            # Видео и аудио качаются отдельными потоками — нумеруем их
+            if filename != self._last_file and filename not in self._active:
+                self._stream += 1
+            self._last_file = filename
+            self._active[filename] = d
+            active = list(self._active.values())
+
+        if len(active) == 1:
+            label = f"потік {self._stream}"
+        else:
+            # Параллельные потоки показываем суммарно
+            label = f"потоків: {len(active)}"
+        totals = [a.get('total_bytes') or a.get('total_bytes_estimate') for a in active]
+        etas = [a.get('eta') for a in active]
+
+        text = f"⏳ Завантаження ({label})"
+        if all(totals):
+            text += f": {sum(a.get('downloaded_bytes') or 0 for a in active) / sum(totals) * 100:.0f}%"
+        speed = sum(a.get('speed') or 0 for a in active)
+        if speed:
+            text += f"\n🚀 {format_bytes(speed)}/с"
+        if None not in etas:
+            text += f"\n⏱ Залишилось ~{int(max(etas))} с"
+        self._show(text)
+
+    def postprocessor_hook(self, d):
+        name = d.get('postprocessor')
+        if d.get('status') == 'started':
+            self._stage_started[name] = time.monotonic()
+            if name == 'Merger':
+                self._show("🔧 Склеюю відео та звук...", force=True)
+        elif d.get('status') == 'finished' and name in self._stage_started:
+            stage = 'merge' if name == 'Merger' else f'postprocess:{name}'
+            self.timings[stage] = time.monotonic() - self._stage_started.pop(name)
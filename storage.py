@@ -0,0 +1,174 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Незавершённые фрагменты yt-dlp: .part, .ytdl, промежуточные .fNNN. и .temp.
+FRAGMENT_RE = re.compile(r'(\.part|\.ytdl|\.part-Frag\d+|\.aria2)$|\.f[\w-]+\.\w+$|\.temp\.\w+$')
+UNSAFE_RE = re.compile(r'[^0-9A-Za-z_-]')
+
+
+class CacheEntry:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.last_used = time.time()
+        self.pins = 0
+
+
+class DownloadCache:
+    """Каталог загрузок с лимитом размера, LRU/TTL-вытеснением и контролем свободного места.
+
+    Файлы хранятся под именем <video_id>~<format_id>.<ext>, поэтому одно и то же
+    видео может быть отправлено повторно без скачивания. Пока файл используется
+    (acquire/add), он закреплён и не вытесняется.
+    """
+
+    def __init__(self, directory='downloads', max_bytes=5 * 1024 ** 3, ttl=3600,
+                 min_free_bytes=1024 ** 3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.min_free_bytes = min_free_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stem(key):
+        """Имя файла (без расширения) для ключа (video_id, format_id)"""
+        video_id, format_id = key
+        return f"{UNSAFE_RE.sub('-', video_id or '')}~{UNSAFE_RE.sub('-', format_id or 'default')}"
+
+    def output_template(self, key):
+        """Шаблон outtmpl для yt-dlp"""
+        return str(self.directory / f"{self.stem(key)}.%(ext)s")
+
+    def recover(self):
+        """Очищает незавершённые фрагменты и заново индексирует готовые файлы (при запуске)"""
+        self.directory.mkdir(exist_ok=True)
+        removed = 0
+
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+            files = sorted((f for f in self.directory.iterdir() if f.is_file()),
+                           key=lambda f: f.stat().st_mtime)
+            for file in files:
+                if FRAGMENT_RE.search(file.name) or '~' not in file.stem:
+                    # Фрагменты и файлы старого формата (video_<uuid>) после сбоя не нужны
+                    self._remove_file(str(file))
+                    removed += 1
+                    continue
+
+                entry = CacheEntry(str(file), file.stat().st_size)
+                entry.last_used = file.stat().st_mtime
+                self._entries[file.stem] = entry
+                self._total += entry.size
+
+            self._evict()
+
+        logging.info(f"Download cache recovered: {len(self._entries)} files, "
+                     f"{self._total / 1024 / 1024:.0f} MB, {removed} stale files removed")
+
+    def acquire(self, key):
+        """Возвращает путь к готовому файлу и закрепляет его, либо None"""
+        with self._lock:
+            entry = self._entries.get(self.stem(key))
+            if entry is None:
+                self.misses += 1
+                return None
+            if not os.path.exists(entry.path):
+                self._drop(self.stem(key))
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry.pins += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(self.stem(key))
+            return entry.path
+
+    def admit(self, estimated_size=None):
+        """Проверяет, что для новой загрузки хватит места, при необходимости вытесняя старые файлы"""
+        size = estimated_size or 0
+
+        with self._lock:
+            self._evict(extra=size)
+
+            while True:
+                free = shutil.disk_usage(self.directory).free
+                if free - size >= self.min_free_bytes:
+                    return True
+                if not self._evict_one():
+                    logging.warning(f"Not enough disk space: free {free} bytes, need {size}")
+                    return False
+
+    def add(self, key, path):
+        """Регистрирует скачанный файл и закрепляет его"""
+        stem = self.stem(key)
+        with self._lock:
+            if stem in self._entries:
+                self._drop(stem, remove=False)
+
+            entry = CacheEntry(path, os.path.getsize(path))
+            entry.pins = 1
+            self._entries[stem] = entry
+            self._total += entry.size
+            return path
+
+    def release(self, key):
+        """Открепляет файл; лишние файлы вытесняются"""
+        with self._lock:
+            entry = self._entries.get(self.stem(key))
+            if entry is not None:
+                entry.pins = max(0, entry.pins - 1)
+                entry.last_used = time.time()
+            self._evict()
+
+    def discard(self, key):
+        """Удаляет файл из кэша (например, если он не подходит для отправки)"""
+        with self._lock:
+            self._drop(self.stem(key))
+
+    def stats(self):
+        return {'files': len(self._entries), 'bytes': self._total, 'max_bytes': self.max_bytes}
+
+    def _evict(self, extra=0):
+        now = time.time()
+        for stem, entry in list(self._entries.items()):
+            if entry.pins == 0 and now - entry.last_used > self.ttl:
+                self._drop(stem)
+
+        while self._total + extra > self.max_bytes and self._evict_one():
+            pass
+
+    def _evict_one(self):
+        # Самый давно использованный незакреплённый файл
+        for stem, entry in self._entries.items():
+            if entry.pins == 0:
+                self._drop(stem)
+                return True
+        return False
+
+    def _drop(self, stem, remove=True):
+        entry = self._entries.pop(stem, None)
+        if entry is None:
+            return
+        self._total -= entry.size
+        if remove:
+            self._remove_file(entry.path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
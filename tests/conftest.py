@@ -0,0 +1,13 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bench
+
+# config читает settings.json из текущего каталога при импорте, поэтому тесты
+# работают во временном каталоге бенчмарка с заглушкой Bot API
+api = bench.FakeBotAPI()
+bench.prepare_workdir(types.SimpleNamespace(webhook=False, n=10), api.url, {})
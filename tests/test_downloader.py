@@ -0,0 +1,79 @@
+import pytest
+
+import downloader
+
+MB = 1024 * 1024
+
+
+def dash_info():
+    """Форматы YouTube-ролика 720p: DASH-потоки H.264, VP9 и AV1, аудио m4a и opus"""
+    def video(format_id, ext, vcodec, height, size):
+        return {'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': 'none',
+                'height': height, 'filesize': size}
+
+    def audio(format_id, ext, acodec, abr, size):
+        return {'format_id': format_id, 'ext': ext, 'vcodec': 'none', 'acodec': acodec,
+                'abr': abr, 'filesize': size}
+
+    return {
+        'id': 'dQw4w9WgXcQ',
+        'duration': 212,
+        'formats': [
+            {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2',
+             'height': 360, 'filesize': 12 * MB},
+            video('134', 'mp4', 'avc1.4d401e', 360, 8 * MB),
+            video('136', 'mp4', 'avc1.4d401f', 720, 30 * MB),
+            video('137', 'mp4', 'avc1.640028', 1080, 70 * MB),
+            video('248', 'webm', 'vp9', 1080, 40 * MB),
+            video('399', 'mp4', 'av01.0.08M.08', 1080, 35 * MB),
+            audio('140', 'm4a', 'mp4a.40.2', 129, 3 * MB),
+            audio('251', 'webm', 'opus', 135, 3 * MB),
+        ],
+    }
+
+
+def test_prefers_telegram_compatible_pair_over_taller_codecs():
+    assert downloader.select_format(dash_info(), 50 * MB) == ('136+140', 33 * MB)
+
+
+def test_compatible_pair_wins_when_it_fits():
+    assert downloader.select_format(dash_info(), 100 * MB) == ('137+140', 73 * MB)
+
+
+def test_falls_back_to_other_codecs_only_when_nothing_compatible_fits():
+    info = dash_info()
+    info['formats'] = [f for f in info['formats'] if f['format_id'] not in ('18', '134', '136', '137')]
+    assert downloader.select_format(info, 50 * MB) == ('248+140', 43 * MB)
+
+
+class FailingAudioYDL:
+    """Заглушка YoutubeDL: видео скачивается, аудио падает с сетевой ошибкой"""
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def process_ie_result(self, info, download=False):
+        if self.opts['format'] == '140':
+            open(self.opts['outtmpl'].replace('%(ext)s', 'm4a.part'), 'wb').close()
+            raise OSError('connection reset')
+        path = self.opts['outtmpl'].replace('%(ext)s', 'mp4')
+        open(path, 'wb').close()
+        return {'requested_downloads': [{'filepath': path}]}
+
+
+def test_download_streams_removes_finished_stream_when_other_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader.yt_dlp, 'YoutubeDL', FailingAudioYDL)
+    download = downloader.Download.__new__(downloader.Download)
+    download.info = dash_info()
+    output_path = tmp_path / 'dQw4w9WgXcQ~136-140.%(ext)s'
+    opts = {'format': '136+140', 'outtmpl': str(output_path), 'merge_output_format': 'mp4'}
+
+    with pytest.raises(OSError):
+        download.download_streams(opts, output_path, ['136', '140'])
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,50 @@
+import asyncio
+
+import telebot
+
+import bench
+import bot
+import async_bot
+
+
+def photo_update(update_id, user_id, caption):
+    """Фото с ссылкой на YouTube в подписи"""
+    update = bench.message_update(update_id, user_id, None)
+    message = update['message']
+    del message['text']
+    message['photo'] = [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 90, 'height': 90}]
+    message['caption'] = caption
+    return telebot.types.Update.de_json(update)
+
+
+def test_sync_bot_downloads_links_from_captions(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot.bot, 'threaded', False)
+    monkeypatch.setattr(bot, 'download_youtube_video',
+                        lambda message, user_id, video_ids: calls.append((user_id, video_ids)))
+
+    bot.bot.process_new_updates([photo_update(1, 1001, 'глянь https://youtu.be/dQw4w9WgXcQ')])
+
+    assert calls == [(1001, ['dQw4w9WgXcQ'])]
+
+
+def test_async_bot_downloads_links_from_captions(monkeypatch):
+    calls = []
+
+    async def download_youtube_video(message, user_id, video_ids):
+        calls.append((user_id, video_ids))
+
+    async def check_subscriptions(user_id):
+        return []
+
+    monkeypatch.setattr(async_bot, 'download_youtube_video', download_youtube_video)
+    monkeypatch.setattr(async_bot, 'check_subscriptions', check_subscriptions)
+
+    asyncio.run(async_bot.abot.process_new_updates([photo_update(2, 1002, 'https://youtu.be/9bZkp7q19f0')]))
+
+    assert calls == [(1002, ['9bZkp7q19f0'])]
+
+
+def test_export_caption_names_the_format_compression_and_part():
+    assert bot.export_caption('json', False, 1, 1) == '📊 *База пользователей (JSON)*'
+    assert bot.export_caption('ndjson', True, 2, 3) == '📊 *База пользователей (NDJSON, gzip)* — часть 2/3'
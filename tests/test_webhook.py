@@ -0,0 +1,34 @@
+import http.client
+
+import pytest
+
+from webhook import WebhookServer
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer(bot=None, host='127.0.0.1', port=0, path='/hook', secret_token='s3cret', workers=0)
+    server.start()
+    yield server
+    server.stop(timeout=5)
+
+
+def post(server, token):
+    connection = http.client.HTTPConnection(*server.address, timeout=5)
+    connection.putrequest('POST', '/hook')
+    connection.putheader('X-Telegram-Bot-Api-Secret-Token', token)
+    connection.putheader('Content-Length', '2')
+    connection.endheaders(b'{}')
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+@pytest.mark.parametrize('token', [b'wrong', 'пароль'.encode('utf-8')])
+def test_wrong_secret_token_is_forbidden(server, token):
+    assert post(server, token) == 403
+
+
+def test_valid_secret_token_is_accepted(server):
+    assert post(server, b's3cret') == 200
+    assert server.updates.get_nowait() == {}
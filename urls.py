@@ -0,0 +1,51 @@
+import re
+
+# Ссылки на видео YouTube: www./m./music., youtube-nocookie.com, youtu.be, shorts/embed/live/v.
+# Параметр v может стоять в любом месте строки запроса (после si=, list= и т. п.)
+YOUTUBE_URL_RE = re.compile(r'''
+    (?<![\w./-])
+    (?:https?://)?
+    (?:(?:www|m|music)\.)?
+    (?:
+        youtube(?:-nocookie)?\.com/
+        (?:
+            (?:watch|attribution_link)?\?(?:[^\s#]*?&)?v=
+          | (?:shorts|embed|live|v|e)/
+        )
+      | youtu\.be/
+    )
+    ([0-9A-Za-z_-]{11})
+    (?![0-9A-Za-z_-])
+''', re.VERBOSE | re.IGNORECASE)
+
+
+def extract_video_id(url):
+    """Возвращает ID видео из ссылки или None"""
+    match = YOUTUBE_URL_RE.search(url or '')
+    return match.group(1) if match else None
+
+
+def extract_video_ids(text, entities=None):
+    """Все ID видео из текста и скрытых ссылок (entities типа text_link) без повторов, в порядке появления"""
+    sources = [text or '']
+    for entity in entities or []:
+        if entity.type == 'text_link' and entity.url:
+            sources.append(entity.url)
+
+    ids = {}
+    for source in sources:
+        for match in YOUTUBE_URL_RE.finditer(source):
+            ids.setdefault(match.group(1))
+    return list(ids)
+
+
+def message_video_ids(message):
+    """ID видео из текста или подписи сообщения Telegram"""
+    if message.text is not None:
+        return extract_video_ids(message.text, message.entities)
+    return extract_video_ids(message.caption, message.caption_entities)
+
+
+def canonical_url(video_id):
+    """Единая ссылка на видео: по ней извлекаются метаданные и ведётся учёт загрузок"""
+    return f"https://www.youtube.com/watch?v={video_id}"
@@ -0,0 +1,112 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import telebot
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь входящих соединений: по умолчанию всего 5, а Telegram открывает до max_connections
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """Встроенный HTTP-сервер для приёма обновлений Telegram через webhook.
+
+    Обновление подтверждается сразу после проверки секрета и попадает в
+    ограниченную очередь; его обработку выполняют потоки-диспетчеры. При
+    переполненной очереди сервер отвечает 503, и Telegram повторит доставку позже.
+
+    Локальная проверка: отправить сохранённый JSON обновления через
+    curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: <secret>" --data @update.json http://127.0.0.1:<port><path>
+    """
+
+    def __init__(self, bot, host='0.0.0.0', port=8443, path='/', secret_token=None,
+                 queue_size=1000, workers=8):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._dispatchers = []
+        self._server = _HTTPServer((host, port), self._make_handler())
+        self._server_thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+
+                token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if server.secret_token and not hmac.compare_digest(token.encode(), server.secret_token.encode()):
+                    self._reply(403)
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    data = json.loads(self.rfile.read(length).decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    self._reply(400)
+                    return
+
+                try:
+                    server.updates.put_nowait(data)
+                except queue.Full:
+                    logging.warning("Webhook dispatch queue is full, asking Telegram to retry")
+                    self._reply(503)
+                    return
+
+                self._reply(200)
+
+            def _reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Не пишем каждую строку доступа в лог бота
+                pass
+
+        return Handler
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._dispatch_loop, name=f'webhook-dispatch-{i}', daemon=True)
+            thread.start()
+            self._dispatchers.append(thread)
+
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='webhook-http', daemon=True)
+        self._server_thread.start()
+        logging.info(f"Webhook server listening on {self.address[0]}:{self.address[1]}{self.path}")
+
+    def stop(self, timeout=None):
+        """Перестаёт принимать обновления и дожидается обработки уже принятых"""
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in self._dispatchers:
+            self.updates.put(None)
+        for thread in self._dispatchers:
+            thread.join(timeout)
+
+    def _dispatch_loop(self):
+        while True:
+            data = self.updates.get()
+            if data is None:
+                break
+
+            try:
+                update = telebot.types.Update.de_json(data)
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logging.error(f"Webhook update processing error: {e}")